@@ -1,20 +1,43 @@
-from flask import Flask, jsonify, render_template, request, abort , send_from_directory 
+from flask import Flask, jsonify, render_template, request, abort , send_file , g , has_request_context
 from flask_jwt_extended import create_access_token , JWTManager ,jwt_required , get_jwt_identity  , decode_token
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_pymongo import PyMongo 
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from bson.errors import InvalidId
 from flask_mail import Mail , Message
 from flask_socketio import SocketIO, emit , disconnect , join_room, leave_room
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
+import click
 
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 
-import os ,json , shutil
-from werkzeug.security import generate_password_hash , check_password_hash
+import os ,json , shutil , atexit , base64 , binascii , mimetypes , functools , time , inspect
 from dotenv import load_dotenv
-from threading import Thread
 import models
+from sessions import SessionStore
+from presence import create_presence_registry
+from cache import RoomCache , RoomEntry , create_invalidation_bus
+from writebehind import WriteBehindWriter
+from audit import LoginAuditLog
+from mailer import MailQueue
+from indexes import INDEXES , collapse_notifications , create_indexes , verify_indexes
+from uploads import ChunkStore , UploadError
+from blobs import BlobStore , is_sha256
+from thumbnails import ThumbnailPipeline , is_image , variant_path
+from passwords import PasswordService
+from concurrency import GREEN_MODES , native_offload , native_thread_tools
+from profiling import RequestProfiler , StackSampler
+from tracing import QueryTracer
+from pools import MongoPoolListener , sqlalchemy_engine_options
+from metrics import MetricsRegistry , StatsCollector , COUNT_BUCKETS
+from pymongo import monitoring
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import datetime 
 
 from cryptography.fernet import Fernet
@@ -26,16 +49,51 @@ app = Flask(__name__)
 CORS(app)
 
 
-socketio = SocketIO(app, cors_allowed_origins=["http://192.168.100.9:3000"])
+# When several workers run side by side , emits go through a shared message queue (e.g. redis://localhost:6379/0)
+# serve.py sets INSYNC_ASYNC_MODE to eventlet or gevent , python app.py keeps the threaded development server
+socketio = SocketIO(app, cors_allowed_origins=["http://192.168.100.9:3000"], message_queue=os.getenv("SOCKETIO_MESSAGE_QUEUE"),
+                    async_mode=os.getenv("INSYNC_ASYNC_MODE", "threading"))
+
+# CPU bound work ( password hashing , thumbnails , hashing assembled uploads ) runs through it so it never blocks the event loop
+offload = native_offload(socketio.async_mode)
 
 app.config["MONGO_URI"] = os.getenv('MONGO_URI')
 
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("POSTGRES_URI")
 
+# Connection pools , size them for the concurrency of one worker ( green threads under serve.py )
+app.config["SQL_POOL_SIZE"] = int(os.getenv("SQL_POOL_SIZE", 10))
+app.config["SQL_MAX_OVERFLOW"] = int(os.getenv("SQL_MAX_OVERFLOW", 20))  # extra connections opened under load , closed once returned
+app.config["SQL_POOL_PRE_PING"] = os.getenv("SQL_POOL_PRE_PING", "1") == "1"  # detects connections dropped by Postgres or a proxy
+app.config["SQL_POOL_RECYCLE"] = int(os.getenv("SQL_POOL_RECYCLE", 1800))  # seconds , -1 never recycles
+app.config["SQL_POOL_TIMEOUT"] = int(os.getenv("SQL_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
+app.config["MONGO_MAX_POOL_SIZE"] = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+app.config["MONGO_WAIT_QUEUE_TIMEOUT_MS"] = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))
+app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")  # when set , /metrics requires "Authorization: Bearer <token>"
+app.config["PROFILE_FOLDER"] = os.getenv("PROFILE_FOLDER", os.path.join(app.root_path, 'profiles'))
+app.config["PROFILE_SAMPLE_RATE"] = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # fraction of requests and socket events run under cProfile
+app.config["PROFILING_TOKEN"] = os.getenv("PROFILING_TOKEN")  # enables /admin/profiling and the X-Profile header , unset disables both
+app.config["PROFILE_MAX_CAPTURE"] = 300  # seconds , longest sampling capture
+app.config["QUERY_TRACING"] = os.getenv("QUERY_TRACING", "0") == "1"  # per handler query counts and slow query logs , off unless QUERY_TRACING=1
+app.config["SLOW_QUERY_MS"] = float(os.getenv("SLOW_QUERY_MS", 100))  # Mongo commands and SQL statements slower than this are logged
+app.config["SLOW_QUERY_EXPLAIN"] = os.getenv("SLOW_QUERY_EXPLAIN", "0") == "1"  # adds a plan summary to slow query logs , runs EXPLAINs against the databases
+app.config["REPEATED_QUERY_THRESHOLD"] = int(os.getenv("REPEATED_QUERY_THRESHOLD", 5))  # same statement this often in one handler is logged ( N+1 ) , 0 disables
+app.config["QUERY_LOG"] = os.getenv("QUERY_LOG")  # JSON lines file , stdout when unset
+app.config["POOL_STATS_INTERVAL"] = int(os.getenv("POOL_STATS_INTERVAL", 0))  # seconds between pool stats logs , 0 disables them
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlalchemy_engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=app.config["SQL_POOL_SIZE"],
+    max_overflow=app.config["SQL_MAX_OVERFLOW"],
+    pre_ping=app.config["SQL_POOL_PRE_PING"],
+    recycle=app.config["SQL_POOL_RECYCLE"],
+    timeout=app.config["SQL_POOL_TIMEOUT"]
+)
+
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'files' )
 
 app.config['USERS_FOLDER'] = os.path.join(app.root_path, 'static', 'files' , "users" )
 app.config['ROOMS_FOLDER'] = os.path.join(app.root_path, 'static', 'files' , "rooms" )
+app.config['BLOBS_FOLDER'] = os.path.join(app.root_path, 'static', 'files' , "blobs" )
 
 app.config['ALLOWED_EXTENSIONS'] = {
     'png', 'jpg', 'jpeg', 'gif',        # Image files
@@ -45,12 +103,22 @@ app.config['ALLOWED_EXTENSIONS'] = {
     'zip', 'tar', 'gz', 'rar', '7z'      # Compressed files
 }
 app.config["MAX_SIZE"] = 100 * 1024 * 1024  
+# Werkzeug rejects bigger request bodies before reading them ( leaves room for the multipart envelope )
+app.config["MAX_CONTENT_LENGTH"] = app.config["MAX_SIZE"] + 1024 * 1024
+app.config['UPLOADS_TMP_FOLDER'] = os.getenv("UPLOADS_TMP_FOLDER", os.path.join(app.root_path, 'uploads_tmp'))
+app.config["UPLOAD_CHUNK_SIZE"] = 5 * 1024 * 1024
+app.config["UPLOAD_EXPIRY"] = 24 * 3600  # seconds before an unfinished chunked upload is dropped
 
 models.db.init_app(app)  
 
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 465
-app.config['MAIL_USE_SSL'] = True
+app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 465))
+app.config['MAIL_USE_SSL'] = os.getenv('MAIL_USE_SSL', "1") == "1"
+app.config["MAIL_WORKERS"] = int(os.getenv("MAIL_WORKERS", 2))  # threads , each one keeps an SMTP connection open
+app.config["MAIL_MAX_PENDING"] = 1000  # queued mails before new ones are dropped
+app.config["MAIL_MAX_RETRIES"] = 4
+app.config["MAIL_RETRY_DELAY"] = 1.0  # seconds , doubled after every failed attempt
+app.config["MAIL_IDLE_TIMEOUT"] = 60  # seconds before an unused SMTP connection is closed
 app.config['MAIL_USERNAME'] = os.getenv('EMAIL_ADDRESS')
 app.config['MAIL_PASSWORD'] = os.getenv('EMAIL_PWD')
 
@@ -62,9 +130,101 @@ app.config["ROOM_KEY"] = os.getenv("ROOM_KEY")
 
 app.config['CACHE_TYPE'] = 'SimpleCache'
 
+app.config["SOCKET_SESSION_SWEEP_INTERVAL"] = 60  # seconds between expired socket session sweeps
+app.config["ROOM_CACHE_SIZE"] = int(os.getenv("ROOM_CACHE_SIZE", 1024))  # rooms kept in the membership cache
+app.config["ROOM_CACHE_TTL"] = int(os.getenv("ROOM_CACHE_TTL", 0))  # seconds , bounds staleness when other workers change memberships ( 0 = no expiry )
+app.config["ROOM_CACHE_REDIS_URL"] = os.getenv("ROOM_CACHE_REDIS_URL", os.getenv("PRESENCE_REDIS_URL"))  # invalidations are published to the other workers
+if os.getenv("SOCKETIO_MESSAGE_QUEUE") and not app.config["ROOM_CACHE_TTL"]:
+    # several workers : a lost invalidation must not leave a member set stale forever
+    app.config["ROOM_CACHE_TTL"] = 60
+app.config["NOTIFICATIONS_PAGE_SIZE"] = 20
+app.config["NOTIFICATIONS_MAX_PAGE_SIZE"] = 100
+app.config["MESSAGE_WRITE_BEHIND"] = os.getenv("MESSAGE_WRITE_BEHIND", "0") == "1"  # broadcast first , persist messages in batches
+app.config["MESSAGE_WRITE_BEHIND_BATCH"] = 500  # documents per insert_many
+app.config["MESSAGE_WRITE_BEHIND_INTERVAL"] = 0.05  # seconds before a partial batch is flushed
+app.config["MESSAGE_WRITE_BEHIND_MAX_PENDING"] = 10000  # buffered messages before senders are slowed down
+app.config["MESSAGES_PAGE_SIZE"] = 20
+app.config["MESSAGES_MAX_PAGE_SIZE"] = 100
+app.config["MONGO_CREATE_INDEXES"] = os.getenv("MONGO_CREATE_INDEXES", "1") == "1"  # create missing indexes when the server starts
+app.config["FILES_OFFLOAD"] = os.getenv("FILES_OFFLOAD", "")  # "" , "x-accel" ( nginx ) or "x-sendfile" ( apache , lighttpd )
+app.config["FILES_ACCEL_PREFIX"] = os.getenv("FILES_ACCEL_PREFIX", "/_files")  # internal nginx location aliased to UPLOAD_FOLDER
+app.config["USE_X_SENDFILE"] = app.config["FILES_OFFLOAD"] == "x-sendfile"
+app.config["BLOB_FILES_MAX_AGE"] = 365 * 24 * 3600  # attachments never change content
+app.config["USER_FILES_MAX_AGE"] = 3600  # avatars and room pictures can be replaced under the same name
+app.config["THUMBNAIL_SIZES"] = (64, 256, 1024)  # pixels , longest side
+app.config["THUMBNAIL_WORKERS"] = int(os.getenv("THUMBNAIL_WORKERS", 2))
+app.config["FILES_BASE_URL"] = os.getenv("FILES_BASE_URL", "http://192.168.100.9:16000")  # prefix of attachment links
+app.config["ATTACHMENT_SWEEP_INTERVAL"] = int(os.getenv("ATTACHMENT_SWEEP_INTERVAL", 3600))  # seconds , 0 disables the integrity sweep
+app.config["USERS_PAGE_SIZE"] = 50
+app.config["USERS_AUTOCOMPLETE_SIZE"] = 10
+app.config["USERS_MAX_PAGE_SIZE"] = 200
+app.config["SEARCH_PAGE_SIZE"] = 20
+app.config["SEARCH_MAX_PAGE_SIZE"] = 50
+app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")  # werkzeug method and work factor , older hashes are upgraded on login
+app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", 2))  # processes , 0 hashes on the request thread
+app.config["LOGIN_AUDIT_RETENTION"] = int(os.getenv("LOGIN_AUDIT_RETENTION_DAYS", 30)) * 24 * 3600  # seconds before login attempts expire
+app.config["LOGIN_AUDIT_BATCH"] = 200
+app.config["LOGIN_AUDIT_INTERVAL"] = 1.0  # seconds before a partial batch of attempts is flushed
+app.config["LOGIN_FAILURE_WINDOW"] = 15 * 60  # seconds , failures are counted over the current and the previous window
+app.config["LOGIN_MAX_FAILURES_PER_USER_IP"] = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER_IP", 10))  # same username from the same ip , 0 disables the check
+app.config["LOGIN_MAX_FAILURES_PER_USER"] = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", 0))  # from any ip , lets anyone lock an account out , 0 disables the check
+app.config["LOGIN_MAX_FAILURES_PER_IP"] = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", 50))  # 0 disables the check
+app.config["PRESENCE_HEARTBEAT_INTERVAL"] = int(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", 10))  # seconds , a worker silent for 3 intervals has its sockets removed from the shared presence
+app.config["PRESENCE_SNAPSHOT_INTERVAL"] = int(os.getenv("PRESENCE_SNAPSHOT_INTERVAL", 0))  # 0 disables the Mongo snapshot
+
 jwt = JWTManager(app)
 mail = Mail(app)
-mongo = PyMongo(app)
+mongo_pool_listener = MongoPoolListener()
+
+
+def count_db_operation(store):
+    """Counts a database call against the route or socket event being handled , if any."""
+    if has_request_context() and "db_operations" in g:
+        g.db_operations[store] += 1
+
+
+class MongoOperationCounter(monitoring.CommandListener):
+    def started(self, event):
+        count_db_operation("mongo")
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    count_db_operation("sql")
+
+
+# green servers hash on native threads instead of a process pool ( hashlib releases the GIL )
+# started here , the hashing processes are forked before PyMongo and the background writers start their threads
+password_service = PasswordService(app.config["PASSWORD_HASH_METHOD"], app.config["PASSWORD_HASH_WORKERS"],
+                                   offload=offload if socketio.async_mode in GREEN_MODES else None).start()
+atexit.register(password_service.shutdown)
+
+query_tracer = None
+mongo_listeners = [mongo_pool_listener, MongoOperationCounter()]
+if app.config["QUERY_TRACING"]:
+    query_tracer = QueryTracer(
+        lambda: g.get("query_trace") if has_request_context() else None,
+        threshold_ms=app.config["SLOW_QUERY_MS"],
+        repeat_threshold=app.config["REPEATED_QUERY_THRESHOLD"],
+        log_path=app.config["QUERY_LOG"],
+        explain=app.config["SLOW_QUERY_EXPLAIN"],
+        get_db=lambda: mongo.db
+    )
+    query_tracer.install(Engine)
+    mongo_listeners.append(query_tracer.mongo_listener())
+
+mongo = PyMongo(
+    app,
+    maxPoolSize=app.config["MONGO_MAX_POOL_SIZE"],
+    waitQueueTimeoutMS=app.config["MONGO_WAIT_QUEUE_TIMEOUT_MS"],
+    event_listeners=mongo_listeners
+)
 
 SWAGGER_URL = '/api/docs'  
 API_URL = '/static/openapi.json'
@@ -83,6 +243,168 @@ limiter = Limiter(get_remote_address, app=app)
 
 cipher_suite = Fernet(app.config["ROOM_KEY"])
 
+socket_sessions = SessionStore()
+background_tasks_started = False
+
+presence = create_presence_registry(os.getenv("PRESENCE_REDIS_URL"), 3 * app.config["PRESENCE_HEARTBEAT_INTERVAL"])
+atexit.register(presence.close)
+
+thumbnail_pipeline = ThumbnailPipeline(app.config["THUMBNAIL_SIZES"], app.config["THUMBNAIL_WORKERS"], offload)
+
+blob_store = BlobStore(app.config['BLOBS_FOLDER'], lambda: mongo.db.Blobs)
+
+chunk_store = ChunkStore(app.config['UPLOADS_TMP_FOLDER'], app.config["UPLOAD_CHUNK_SIZE"])
+
+room_cache_bus = create_invalidation_bus(app.config["ROOM_CACHE_REDIS_URL"])
+room_cache = RoomCache(app.config["ROOM_CACHE_SIZE"], app.config["ROOM_CACHE_TTL"],
+                       on_change=room_cache_bus.publish if room_cache_bus else None)
+
+login_audit = LoginAuditLog(
+    lambda: mongo.db.login_attempts,
+    lambda: mongo.db.LoginCounters,
+    retention=app.config["LOGIN_AUDIT_RETENTION"],
+    window=app.config["LOGIN_FAILURE_WINDOW"],
+    batch_size=app.config["LOGIN_AUDIT_BATCH"],
+    flush_interval=app.config["LOGIN_AUDIT_INTERVAL"]
+).start()
+atexit.register(login_audit.close)
+
+mongo_indexes = {**INDEXES, **login_audit.indexes()}
+
+mail_queue = MailQueue(
+    app,
+    mail,
+    workers=app.config["MAIL_WORKERS"],
+    max_pending=app.config["MAIL_MAX_PENDING"],
+    max_retries=app.config["MAIL_MAX_RETRIES"],
+    retry_delay=app.config["MAIL_RETRY_DELAY"],
+    idle_timeout=app.config["MAIL_IDLE_TIMEOUT"]
+).start()
+atexit.register(mail_queue.close)
+
+message_writer = None
+if app.config["MESSAGE_WRITE_BEHIND"]:
+    message_writer = WriteBehindWriter(
+        lambda: mongo.db.UserMessages,
+        batch_size=app.config["MESSAGE_WRITE_BEHIND_BATCH"],
+        flush_interval=app.config["MESSAGE_WRITE_BEHIND_INTERVAL"],
+        max_pending=app.config["MESSAGE_WRITE_BEHIND_MAX_PENDING"]
+    ).start()
+    atexit.register(message_writer.close)
+
+metrics = MetricsRegistry()
+http_requests = metrics.counter("insync_http_requests_total", "HTTP requests by route , method and status", ("route", "method", "status"))
+http_latency = metrics.histogram("insync_http_request_duration_seconds", "HTTP request latency", ("route", "method"))
+socket_events = metrics.counter("insync_socket_events_total", "Socket.IO events handled , outcome is ok or error", ("event", "outcome"))
+socket_latency = metrics.histogram("insync_socket_event_duration_seconds", "Socket.IO event handler latency", ("event",))
+db_operations = metrics.histogram("insync_db_operations_per_handler", "Mongo commands and SQL statements issued by one request or socket event",
+                                  ("store", "handler"), COUNT_BUCKETS)
+message_fanout = metrics.histogram("insync_message_fanout", "Recipients of one sendMessage : users joined to the room , "
+                                   "online members notified , offline members getting a stored notification", ("delivery",), COUNT_BUCKETS)
+
+
+def joined_rooms_count():
+    """Socket.IO rooms joined on this worker , without the room every socket has for itself."""
+    rooms = socketio.server.manager.rooms.get('/', {})
+    return sum(1 for room, sids in rooms.items() if room is not None and room not in sids)
+
+
+metrics.gauge("insync_connected_sockets", "Authenticated sockets connected to this worker", lambda: len(socket_sessions))
+metrics.gauge("insync_joined_rooms", "Chat rooms with at least one socket joined on this worker", joined_rooms_count)
+metrics.register(StatsCollector("insync_room_cache", lambda: room_cache.stats, "Room membership cache"))
+metrics.register(StatsCollector("insync_room_cache_bus", lambda: room_cache_bus.stats if room_cache_bus else None, "Room cache invalidations between workers"))
+metrics.register(StatsCollector("insync_message_writer", lambda: message_writer.stats if message_writer else None, "Write-behind message writer"))
+metrics.register(StatsCollector("insync_login_audit", lambda: login_audit.stats, "Login audit log writer"))
+metrics.register(StatsCollector("insync_mail_queue", lambda: mail_queue.stats, "Outgoing mail queue"))
+metrics.register(StatsCollector("insync_passwords", lambda: password_service.stats, "Password hashing"))
+metrics.register(StatsCollector("insync_thumbnails", lambda: thumbnail_pipeline.stats, "Thumbnail pipeline"))
+metrics.register(StatsCollector("insync_sql_pool", lambda: pool_stats()["sql"], "Postgres connection pool"))
+metrics.register(StatsCollector("insync_query_tracer", lambda: query_tracer.stats if query_tracer else None, "Slow and repeated query tracer"))
+metrics.register(StatsCollector("insync_mongo_pool", lambda: mongo_pool_listener.pool_stats.stats, "Mongo connection pool"))
+
+
+request_profiler = RequestProfiler(os.path.join(app.config["PROFILE_FOLDER"], "requests"), app.config["PROFILE_SAMPLE_RATE"])
+atexit.register(request_profiler.dump)
+
+def handler_endpoints():
+    """Code objects of the route and socket event handlers , the sampler attributes stacks with them."""
+    endpoints = {}
+    for rule in app.url_map.iter_rules():
+        endpoints[inspect.unwrap(app.view_functions[rule.endpoint]).__code__] = rule.rule
+    for event_name, handler in socketio.server.handlers.get('/', {}).items():
+        endpoints[inspect.unwrap(handler).__code__] = event_name
+    return endpoints
+
+def restore_sample_rate():
+    request_profiler.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+    request_profiler.dump()
+
+native_thread , native_sleep = native_thread_tools(socketio.async_mode)
+stack_sampler = StackSampler(app.config["PROFILE_FOLDER"], handler_endpoints, native_thread, native_sleep,
+                             max_duration=app.config["PROFILE_MAX_CAPTURE"], on_finish=restore_sample_rate)
+
+
+def start_handler_metrics(handler):
+    g.metrics_handler = handler
+    g.metrics_started = time.perf_counter()
+    g.db_operations = {"mongo": 0, "sql": 0}
+    if query_tracer:
+        g.query_trace = query_tracer.begin(handler)
+
+def observe_db_operations():
+    for store, count in g.db_operations.items():
+        db_operations.observe(count, store, g.metrics_handler)
+    if query_tracer:
+        query_tracer.end(g.pop("query_trace", None))
+
+def start_profile():
+    """cProfile for a sampled fraction of the calls , or every call carrying the admin X-Profile header
+    ( for socket events , the header of the handshake )."""
+    forced = bool(app.config["PROFILING_TOKEN"]) and request.headers.get("X-Profile") == app.config["PROFILING_TOKEN"]
+    if request_profiler.should_profile(forced):
+        g.profile = request_profiler.start()
+
+def finish_profile():
+    profile = g.pop("profile", None)
+    if profile:
+        request_profiler.finish(profile, g.metrics_handler)
+
+@app.before_request
+def start_request_metrics():
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    start_handler_metrics(route)
+    start_profile()
+
+@app.after_request
+def record_request_metrics(response):
+    if "metrics_started" in g:
+        finish_profile()
+        http_latency.observe(time.perf_counter() - g.metrics_started, g.metrics_handler, request.method)
+        http_requests.inc(g.metrics_handler, request.method, response.status_code)
+        observe_db_operations()
+    return response
+
+def instrument_event(handler):
+    """Records latency , outcome and database operations of a Socket.IO event handler.
+    Goes under @socketio.on , the event name comes from the request Flask-SocketIO builds for every event.
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        event_name = request.event["message"]
+        start_handler_metrics(event_name)
+        start_profile()
+        outcome = "error"
+        try:
+            result = handler(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            finish_profile()
+            socket_latency.observe(time.perf_counter() - g.metrics_started, event_name)
+            socket_events.inc(event_name, outcome)
+            observe_db_operations()
+    return wrapper
+
 
 def allowed_file(filename):
     """Check if the file extension is allowed."""
@@ -97,10 +419,6 @@ def decode_jwt(token):
     except jwt.InvalidTokenError:
         return None
     
-def send_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
-
 def create_encrypted_room_code(room_id, room_name, cipher_suite):
     room_info = {
         "room_id": room_id,
@@ -113,9 +431,334 @@ def create_encrypted_room_code(room_id, room_name, cipher_suite):
     
     return encrypted_room_code
 
+# Pagination cursors are (sort key , _id) pairs , the sort key stored under a short name
+CURSOR_KEYS = {
+    "timestamp": ("t", lambda timestamp: timestamp.isoformat(), datetime.datetime.fromisoformat),
+    "score": ("s", float, float),
+}
+
+def encode_cursor(message, key):
+    """Opaque pagination cursor built from the (key , _id) of a message , key is one of CURSOR_KEYS."""
+    name, dump, _ = CURSOR_KEYS[key]
+    cursor = json.dumps({name: dump(message[key]), "id": str(message["_id"])})
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+def decode_cursor(cursor, key):
+    """Returns the (key , _id) pair of a cursor , raises ValueError if it is malformed."""
+    name, _, load = CURSOR_KEYS[key]
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return load(data[name]), ObjectId(data["id"])
+    except (TypeError, KeyError, ValueError, binascii.Error, InvalidId) as e:
+        raise ValueError("Invalid cursor") from e
+
+def message_payload(message):
+    """Stored message as sent to clients."""
+    message_data = {
+        'user_id': message['sender_id'],
+        'room_id': message['room_id'],
+        'message': message['message'],
+        'message_type': message['message_type'],
+        'timestamp': message['timestamp']
+    }
+
+    if 'attachments' in message:
+        # Metadata was stored with the message , no filesystem access here
+        message_data['attachments'] = attachment_payload(message['room_id'], message['attachments'])
+
+    return message_data
+
+def search_messages(room_ids, text, limit, cursor=None):
+    """Ranked full text search over the messages of the given rooms , best match first.
+    Pages are cut on (text score , _id) so deep pages do not re-rank skipped results.
+    """
+    pipeline = [
+        {'$match': {'$text': {'$search': text}, 'room_id': {'$in': list(room_ids)}}},
+        {'$addFields': {'score': {'$meta': 'textScore'}}},
+    ]
+    if cursor:
+        score, message_id = decode_cursor(cursor, 'score')
+        pipeline.append({'$match': {'$or': [
+            {'score': {'$lt': score}},
+            {'score': score, '_id': {'$lt': message_id}}
+        ]}})
+    pipeline += [
+        {'$sort': {'score': -1, '_id': -1}},
+        {'$limit': limit + 1},
+    ]
+    results = list(mongo.db.UserMessages.aggregate(pipeline))
+    has_more = len(results) > limit
+    results = results[:limit]
+
+    return {
+        'messages': [dict(message_payload(message), score=message['score']) for message in results],
+        'next_cursor': encode_cursor(results[-1], 'score') if has_more else None
+    }
+
+def record_attachment(room_id, filename, size, content_type, checksum, user_id):
+    """Maps a file name in the room to the blob holding its content , and references the blob.
+    The same content under the same name reuses the mapping , a different content under a taken
+    name gets a name of its own so earlier messages keep pointing at their file.
+    """
+    stem, extension = os.path.splitext(filename)
+    names = [filename, f"{stem}-{checksum[:8]}{extension}", f"{stem}-{checksum}{extension}"]
+
+    # Referenced before the mapping is inserted , so a mapping found below always holds its own
+    # reference and ours can be dropped without collecting the blob
+    blob_store.add_ref(checksum, size)
+    while True:
+        for name in names:
+            existing = mongo.db.Attachments.find_one({"room_id": room_id, "name": name})
+            if existing is None or existing.get("sha256") == checksum:
+                break
+        if existing:
+            blob_store.release([checksum])
+            return existing
+
+        attachment = models.Attachment(room_id , name , size , content_type , checksum , user_id).json
+        try:
+            mongo.db.Attachments.insert_one(attachment)
+            return attachment
+        except DuplicateKeyError:
+            # the name was taken concurrently , resolve it again against what the other writer stored
+            continue
+        except Exception:
+            blob_store.release([checksum])
+            raise
+
+def user_has_blob(user_id, sha256):
+    """True when the blob is attached in one of the user's rooms."""
+    room_ids = [room_id for (room_id,) in models.db.session.query(models.RoomUsers.room_id).filter_by(user_id=user_id)]
+    return bool(room_ids) and mongo.db.Attachments.find_one({"sha256": sha256, "room_id": {"$in": room_ids}}, {"_id": 1}) is not None
+
+def attachment_path(room_id, attachment):
+    """Where the content of an attachment lives , its blob or the room folder for files stored before blobs."""
+    if attachment.get("sha256") and blob_store.exists(attachment["sha256"]):
+        return blob_store.path(attachment["sha256"])
+    return os.path.join(app.config["ROOMS_FOLDER"], str(room_id), attachment["name"])
+
+def delete_room_attachments(room_id):
+    """Drops the attachments of a deleted room and the blobs no other room references."""
+    attachments = list(mongo.db.Attachments.find({"room_id": room_id}, {"sha256": 1}))
+    mongo.db.Attachments.delete_many({"room_id": room_id})
+    return blob_store.release([attachment["sha256"] for attachment in attachments if attachment.get("sha256")])
+
+def find_upload(room_id, upload_id):
+    """Returns the chunked upload started by the current user , or an error response."""
+    current_user = get_jwt_identity()
+    upload = mongo.db.Uploads.find_one({'upload_id': upload_id, 'room_id': room_id})
+    if not upload or upload['user_id'] != current_user.get("user_id"):
+        return None, (jsonify({'error': 'Upload not found'}), 404)
+    return upload, None
+
+def expire_uploads():
+    """Drops the chunked uploads that were not completed in time , returns how many."""
+    limit = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=app.config["UPLOAD_EXPIRY"])
+    expired = list(mongo.db.Uploads.find({'created_at': {'$lt': limit}}, {'upload_id': 1}))
+    for upload in expired:
+        chunk_store.discard(upload['upload_id'])
+    if expired:
+        mongo.db.Uploads.delete_many({'upload_id': {'$in': [upload['upload_id'] for upload in expired]}})
+    return len(expired)
+
+def attachment_payload(room_id, attachment):
+    """Attachment as sent to clients , the link is built from FILES_BASE_URL."""
+    payload = {
+        'name': attachment['name'],
+        'link': f"{app.config['FILES_BASE_URL']}/rooms/{room_id}/{attachment['name']}",
+        'size': attachment.get('size'),
+        'content_type': attachment.get('content_type'),
+        'sha256': attachment.get('sha256')
+    }
+    if is_image(attachment['name']):
+        payload['variants'] = picture_variants("rooms", f"/{room_id}/{attachment['name']}")
+    if attachment.get('missing'):
+        payload['missing'] = True
+    return payload
+
+def picture_variants(route, picture):
+    """Thumbnail urls of an image by size. The file routes serve the original until a thumbnail is ready."""
+    if not picture or not is_image(picture):
+        return None
+    url = f"{app.config['FILES_BASE_URL']}/{route}/{picture.lstrip('/')}"
+    return {str(size): f"{url}?size={size}" for size in app.config["THUMBNAIL_SIZES"]}
+
+def serve_picture(path, name):
+    """Serves an avatar or room picture , or the thumbnail asked for with ?size= once it is ready."""
+    if request.args.get('size'):
+        variant = requested_variant(path, name)
+        if not variant:
+            # Thumbnail not ready yet , the original must not be cached under the thumbnail url
+            return serve_file(path, name, max_age=0)
+        return serve_file(variant, os.path.basename(variant), max_age=app.config["USER_FILES_MAX_AGE"])
+    return serve_file(path, name, max_age=app.config["USER_FILES_MAX_AGE"])
+
+def requested_variant(path, name):
+    """Path of the thumbnail asked for with ?size= , or None to serve the original."""
+    size = request.args.get('size', type=int)
+    if size not in app.config["THUMBNAIL_SIZES"] or not is_image(name):
+        return None
+    variant = variant_path(path, size, name)
+    return variant if os.path.exists(variant) else None
+
+def sweep_attachments():
+    """Flags the attachments whose file is gone from disk , and their messages.
+    Returns the number of attachments newly flagged as missing.
+    """
+    flagged = 0
+    for attachment in mongo.db.Attachments.find({"missing": {"$ne": True}}, {"room_id": 1, "name": 1, "sha256": 1}):
+        if os.path.exists(attachment_path(attachment["room_id"], attachment)):
+            continue
+        mongo.db.Attachments.update_one({"_id": attachment["_id"]}, {"$set": {"missing": True}})
+        mongo.db.UserMessages.update_many(
+            {"room_id": attachment["room_id"], "attachments.name": attachment["name"]},
+            {"$set": {"attachments.missing": True}}
+        )
+        flagged += 1
+    return flagged
+
+def run_file_maintenance():
+    """Background task , runs the attachment integrity sweep and drops stale chunked uploads periodically."""
+    while True:
+        socketio.sleep(app.config["ATTACHMENT_SWEEP_INTERVAL"])
+        with app.app_context():
+            flagged = sweep_attachments()
+            expired = expire_uploads()
+        if flagged:
+            print(f"attachment sweep: {flagged} missing files")
+        if expired:
+            print(f"upload cleanup: {expired} expired uploads")
+
+@functools.lru_cache(maxsize=4096)
+def get_room_code(room_id, room_name):
+    """Room codes only depend on the room , encrypt them once per (room_id , room_name)."""
+    return create_encrypted_room_code(room_id , room_name , cipher_suite).decode('utf-8')
+
+def get_member_rooms(user_id, room_type):
+    """Rooms of a given type the user belongs to , in one query."""
+    return models.Room.query \
+        .join(models.RoomUsers, models.Room.room_id == models.RoomUsers.room_id) \
+        .filter(models.RoomUsers.user_id == user_id, models.Room.room_type == room_type) \
+        .order_by(models.Room.room_id) \
+        .all()
+
+def get_room_members(room_ids, exclude_user_id=None):
+    """Members of several rooms in one query , grouped by room_id."""
+    if not room_ids:
+        return {}
+    query = models.db.session.query(models.RoomUsers.room_id, models.User) \
+        .join(models.User, models.User.user_id == models.RoomUsers.user_id) \
+        .filter(models.RoomUsers.room_id.in_(room_ids))
+    if exclude_user_id is not None:
+        query = query.filter(models.User.user_id != exclude_user_id)
+
+    users_by_room = {}
+    for room_id, user in query.all():
+        users_by_room.setdefault(room_id, []).append(user)
+    return users_by_room
+
+def prefix_filter(column, term):
+    """Case insensitive prefix match that the lower(column) varchar_pattern_ops indexes can serve."""
+    escaped = term.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return models.db.func.lower(column).like(f"{escaped}%", escape="\\")
+
+def serve_file(path, download_name, mimetype=None, etag=True, max_age=None, immutable=False):
+    """Sends a file with validators and cache headers , or hands the transfer to the front proxy.
+
+    With FILES_OFFLOAD = "x-accel" the response only carries an X-Accel-Redirect to the internal
+    location mapped on UPLOAD_FOLDER ( FILES_ACCEL_PREFIX ) and nginx serves the bytes and Range requests.
+    With "x-sendfile" Flask emits X-Sendfile ( USE_X_SENDFILE ). Otherwise the worker streams the file
+    and answers conditional and Range requests itself.
+    """
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    if app.config["FILES_OFFLOAD"] == "x-accel":
+        response = app.response_class(mimetype=mimetype)
+        relative_path = os.path.relpath(path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = f"{app.config['FILES_ACCEL_PREFIX']}/{relative_path}"
+        if isinstance(etag, str):
+            response.set_etag(etag)
+            response = response.make_conditional(request)
+    else:
+        response = send_file(path, mimetype=mimetype, download_name=download_name, etag=etag, conditional=True, max_age=max_age)
+
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = immutable
+    return response
+
+def load_room_entry(room_id):
+    """Loads a room and its members for the room cache."""
+    room = models.Room.query.filter_by(room_id=room_id).first()
+    if not room:
+        return None
+    room_users = models.RoomUsers.query.filter_by(room_id=room_id).all()
+    return RoomEntry(room.room_id, room.room_name, room.room_type, {room_user.user_id for room_user in room_users})
+
+def get_socket_session():
+    """Returns the session opened on connect for the current socket.
+    Emits an error and returns None when the socket is unknown or its token expired.
+    """
+    session = socket_sessions.get(request.sid)
+    if not session:
+        emit('error', {'message': 'Invalid or expired token!'})
+        return None
+    if session.expired:
+        emit('error', {'message': 'Invalid or expired token!'})
+        socket_sessions.close(request.sid)
+        disconnect()
+        return None
+    return session
+
+def expire_socket_sessions():
+    """Background task , forces a disconnect on every socket whose token has expired."""
+    while True:
+        socketio.sleep(app.config["SOCKET_SESSION_SWEEP_INTERVAL"])
+        for session in socket_sessions.expired():
+            socketio.emit('error', {'message': 'Token expired!'}, room=session.sid)
+            socketio.server.disconnect(session.sid, namespace='/')
+
+def presence_heartbeat():
+    """Background task , keeps this worker alive in the shared presence and cleans up after dead ones."""
+    while True:
+        try:
+            presence.heartbeat()
+        except Exception as e:
+            print(f"presence: heartbeat failed: {e}")
+        socketio.sleep(app.config["PRESENCE_HEARTBEAT_INTERVAL"])
+
+def pool_stats():
+    """Checked out connections , waits , timeouts and churn of the Postgres and Mongo pools."""
+    stats = {"mongo": mongo_pool_listener.pool_stats.stats}
+    sql_pool = models.db.engine.pool
+    sql_stats = getattr(sql_pool, "pool_stats", None)
+    stats["sql"] = dict(sql_stats.stats if sql_stats else {}, status=sql_pool.status())
+    return stats
+
+def log_pool_stats():
+    """Background task , prints the pool stats so waits and exhaustion show up in the worker logs."""
+    while True:
+        socketio.sleep(app.config["POOL_STATS_INTERVAL"])
+        with app.app_context():
+            print(f"pools: {json.dumps(pool_stats())}")
+
+def snapshot_presence():
+    """Background task , mirrors the presence registry into Mongo for tooling that still reads
+    the OnlineUsers , UserSockets and JoinedUsers collections. Nothing on the hot path reads them.
+    """
+    while True:
+        socketio.sleep(app.config["PRESENCE_SNAPSHOT_INTERVAL"])
+        with app.app_context():
+            for collection, documents in presence.snapshot().items():
+                mongo.db[collection].delete_many({})
+                if documents:
+                    mongo.db[collection].insert_many(documents)
+
 
 @socketio.on('connect')
 def handle_connect():
+    global background_tasks_started
     token = request.args.get('token')
     if not token:
         disconnect()  
@@ -125,55 +768,38 @@ def handle_connect():
     if not user_payload:
         disconnect()  
         return
-    user_id = user_payload["sub"]['user_id'] 
 
-    # Add user to online users collection
-    mongo.db.OnlineUsers.update_one(
-        {"user_id": user_id},
-        {"$set": {"user_id": user_id}},
-        upsert=True
-    )
+    session = socket_sessions.open(request.sid, user_payload)
 
-    # Save user socket_id to User Sockets collection
-    socket_id = request.sid
-    mongo.db.UserSockets.update_one(
-        {"user_id": user_id},
-        {"$set": {"socket_id": socket_id}},
-        upsert=True
-    )
+    if not background_tasks_started:
+        background_tasks_started = True
+        socketio.start_background_task(expire_socket_sessions)
+        socketio.start_background_task(presence_heartbeat)
+        if room_cache_bus:
+            socketio.start_background_task(room_cache_bus.listen, room_cache, socketio.sleep)
+        if app.config["PRESENCE_SNAPSHOT_INTERVAL"]:
+            socketio.start_background_task(snapshot_presence)
+        if app.config["ATTACHMENT_SWEEP_INTERVAL"]:
+            socketio.start_background_task(run_file_maintenance)
+        if app.config["POOL_STATS_INTERVAL"]:
+            socketio.start_background_task(log_pool_stats)
+
+    presence.connect(request.sid, session.user_id)
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    token = request.args.get('token')
-    if not token:
-        return
-
-    user_payload = decode_jwt(token)
-    if not user_payload:
-        return
-
-    user_id = user_payload["sub"]["user_id"]
-
-    # Remove user from online users collection
-    mongo.db.OnlineUsers.delete_one({"user_id": user_id})
-
-    # Remove user from User Sockets collection
-    mongo.db.UserSockets.delete_one({"user_id": user_id})
+    socket_sessions.close(request.sid)
+    presence.disconnect(request.sid)
 
 
 @socketio.on('joinRoom')
+@instrument_event
 def join_room_event(data):
-    token = request.args.get('token')
-    if not token:
-        emit('error', {'message': 'Token is missing!'})
-        return
-
-    user_payload = decode_jwt(token)
-    if not user_payload:
-        emit('error', {'message': 'Invalid or expired token!'})
+    session = get_socket_session()
+    if not session:
         return
 
-    user_id = user_payload["sub"]['user_id'] 
+    user_id = session.user_id
     room_id = data.get('room_id')
     if not room_id:
         emit('error', {'message': 'Room ID is required!'})
@@ -181,11 +807,7 @@ def join_room_event(data):
 
     join_room(room_id)
 
-    mongo.db.JoinedUsers.update_one(
-        {"room_id": room_id, "user_id": user_id},
-        {"$set": {"room_id": room_id, "user_id": user_id}},
-        upsert=True
-    )
+    presence.join(request.sid, room_id)
 
 
     emit('user_joined', {'user_id': user_id, 'room_id': room_id}, room=room_id)
@@ -194,21 +816,13 @@ def join_room_event(data):
 
 
 @socketio.on('joinDirectRoom')
+@instrument_event
 def join_direct_room(data):
-    token = request.args.get('token')
-
-    if not token:
-        emit('error', {'message': 'Token is missing!'})
+    session = get_socket_session()
+    if not session:
         return
 
-    user_payload = decode_jwt(token)
-
-    if not user_payload:
-        emit('error', {'message': 'Invalid or expired token!'})
-        return
-
-
-    user_id = user_payload["sub"]['user_id']  
+    user_id = session.user_id
     recipient = data.get('room')["users"][0]
     recipient_id = recipient["user_id"]
     room_id = data["room"]['room_id']
@@ -216,11 +830,7 @@ def join_direct_room(data):
 
     join_room(room_id)
 
-    mongo.db.JoinedUsers.update_one(
-        {"room_id": room_id, "user_id": user_id},
-        {"$set": {"room_id": room_id, "user_id": user_id}},
-        upsert=True
-    )
+    presence.join(request.sid, room_id)
 
 
 
@@ -230,18 +840,13 @@ def join_direct_room(data):
     })
 
 @socketio.on('leaveRoom')
+@instrument_event
 def leave_room_event(data):
-    token = request.args.get('token')
-    if not token:
-        emit('error', {'message': 'Token is missing!'})
-        return
-
-    user_payload = decode_jwt(token)
-    if not user_payload:
-        emit('error', {'message': 'Invalid or expired token!'})
+    session = get_socket_session()
+    if not session:
         return
 
-    user_id = user_payload["sub"]['user_id']
+    user_id = session.user_id
     room_id = data
 
     if not room_id:
@@ -250,7 +855,7 @@ def leave_room_event(data):
 
     leave_room(room_id)
 
-    mongo.db.JoinedUsers.delete_one({"room_id": room_id, "user_id": user_id})
+    presence.leave(request.sid, room_id)
 
 
     emit('user_left', {'user_id': user_id, 'room_id': room_id}, room=room_id)
@@ -258,19 +863,14 @@ def leave_room_event(data):
     emit('left_room', {'message': f'You have left the room {room_id}'})
 
 @socketio.on('sendMessage')
+@instrument_event
 def handle_send_message(data):
-    token = request.args.get('token')
-    if not token:
-        emit('error', {'message': 'Token is missing!'})
-        return
-
-    user_payload = decode_jwt(token)
-    if not user_payload:
-        emit('error', {'message': 'Invalid or expired token!'})
+    session = get_socket_session()
+    if not session:
         return
 
-    user_id = user_payload["sub"]['user_id']
-    user = models.User.query.filter_by(user_id=user_id).first()    
+    user_id = session.user_id
+    username = session.username
     room_id = data.get('room_id')
 
     if not room_id:
@@ -280,85 +880,104 @@ def handle_send_message(data):
     attachments = data.get('attachments')  
     message = data.get('message')
 
+    if (message is not None and not isinstance(message, str)) or (attachments is not None and not isinstance(attachments, dict)):
+        emit('error', {'message': 'Invalid message!'})
+        return
+
     if not message and not attachments:
         emit('error', {'message': 'Either a message or an attachments is required!'})
         return
 
-    room = models.Room.query.filter_by(room_id=room_id).first()
+    try:
+        room = room_cache.get(int(room_id), load_room_entry)
+    except (TypeError, ValueError):
+        room = None
+
+    if not room:
+        emit('error', {'message': 'Room not found!'})
+        return
 
     if attachments:
         message_type='file'
-        attachment_name = attachments.get('name')  
-        attachment_link = attachments.get("link")
-        attachment_size = attachments.get('size') 
-        user_message = models.UserMessage(user_id , room_id , "" , "file" , {'name': attachment_name,'link': attachment_link,'size': attachment_size} ).json
+        # Only trust the metadata recorded by upload_file , the client just names the file
+        attachment = mongo.db.Attachments.find_one(
+            {"room_id": room.room_id, "name": secure_filename(attachments.get('name') or '')},
+            {"_id": 0, "name": 1, "size": 1, "content_type": 1, "sha256": 1}
+        )
+        if not attachment:
+            emit('error', {'message': 'Unknown attachment!'})
+            return
+        user_message = models.UserMessage(user_id , room_id , "" , "file" , attachment ).json
     else:
         message_type='text'
         user_message = models.UserMessage(user_id , room_id , message , "text" ).json
 
-
-    mongo.db.UserMessages.insert_one(user_message)
+    if not message_writer:
+        mongo.db.UserMessages.insert_one(user_message)
 
     emit_data = {
         'room_id': room_id,
-        'username': user.username,
+        'username': username,
         'user_id': user_id,
         'message_type': message_type,
         'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat()
     }
 
     if message_type == "file":
-        emit_data['attachments'] = {
-            'name': attachment_name,
-            'link': attachment_link,
-            'size': attachment_size
-        }
+        emit_data['attachments'] = attachment_payload(room.room_id, attachment)
     else:
         emit_data['message'] = message
 
     emit('receiveMessage', emit_data, room=room_id)
 
+    # With write-behind enabled the message is persisted after the broadcast , in batches
+    if message_writer:
+        message_writer.submit(user_message)
+
     if room.room_name:
         room_name = room.room_name
     else:
-        room_name = user.username
+        room_name = username
 
 
     # Get the users in a room ( DB wise )
-    room_users = models.RoomUsers.query.filter_by(room_id=room_id).all()
-    users_in_db_room = {room_user.user_id for room_user in room_users}
+    users_in_db_room = room.members
 
-    # Get the online users from the cache (those who are logged in)
-    online_users = {user["user_id"] for user in mongo.db.OnlineUsers.find()}
+    # Get the members of the room that are online (those who are connected)
+    online_users = presence.online_among(users_in_db_room)
 
-    # Get the users that are logged in and currently in a room
-    joined_users_in_room = {user["user_id"] for user in mongo.db.RoomUsers.find({"room_id": room_id})}
+    # Get the users that are connected and currently in the room
+    joined_users_in_room = presence.joined_users(room_id)
 
     """The users that should be notified in real time ( the users that are in the DB , That are online , and havent joined the room)
         am using intersection of sets to do that
     """
     
-    users_to_notify_in_realtime = users_in_db_room & online_users - joined_users_in_room - {user_id}
-
-    print("realtime " , users_to_notify_in_realtime)
+    users_to_notify_in_realtime = online_users - joined_users_in_room - {user_id}
 
     """The users that should be notified once connected ( the users that are in the DB , That arent online )
     """
     users_to_notify_once_connected = users_in_db_room - online_users
-    print("once connected " , users_to_notify_once_connected)
 
-    for user in users_to_notify_once_connected:
-        notification = models.Notifications(user , room_id , room_name).json
-        mongo.db.Notifications.insert_one(notification)
+    message_fanout.observe(len(joined_users_in_room), "room")
+    message_fanout.observe(len(users_to_notify_in_realtime), "notification")
+    message_fanout.observe(len(users_to_notify_once_connected), "stored_notification")
+
+    # One counter document per (user , room) , all of them written in a single round trip
+    notification_updates = [
+        UpdateOne(*models.Notifications(user , room.room_id , room_name).upsert, upsert=True)
+        for user in users_to_notify_once_connected
+    ]
+    if notification_updates:
+        mongo.db.Notifications.bulk_write(notification_updates, ordered=False)
 
     for user in users_to_notify_in_realtime:
-        socket_id = mongo.db.UserSockets.find_one({"user_id": user})["socket_id"]
-        if socket_id:
-            notification = {
-                'user_id': user,
-                'room_id': room_id,
-                'room_name': room_name,
-            }
+        notification = {
+            'user_id': user,
+            'room_id': room_id,
+            'room_name': room_name,
+        }
+        for socket_id in presence.sids_of(user):
             emit('notification', notification, room=socket_id)
 
 
@@ -383,6 +1002,7 @@ def get_current_user():
         "account_status": user.account_status,
         "role": user.role,
         "profile_picture": user.profile_picture,
+        "profile_picture_variants": picture_variants("users", user.profile_picture),
         "isLogged": user.isLogged,
         "created_at": user.created_at.isoformat()
     }
@@ -401,11 +1021,27 @@ def get_users():
     is_logged = request.args.get("isLogged")
     first_name = request.args.get("first_name")
     last_name = request.args.get("last_name")
-    
+    search = request.args.get("q")
+    autocomplete = request.args.get("autocomplete", "").lower() in ("1", "true")
+
+    try:
+        default_limit = app.config["USERS_AUTOCOMPLETE_SIZE"] if autocomplete else app.config["USERS_PAGE_SIZE"]
+        limit = max(1, min(int(request.args.get("limit", default_limit)), app.config["USERS_MAX_PAGE_SIZE"]))
+        cursor = int(request.args.get("cursor", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+
+    if search:
+        # Free text box , matches the start of the username or of the names
+        query = query.filter(models.db.or_(
+            prefix_filter(models.User.username, search),
+            prefix_filter(models.User.first_name, search),
+            prefix_filter(models.User.last_name, search)
+        ))
     if username:
-        query = query.filter(models.User.username.ilike(f"%{username}%")) 
+        query = query.filter(prefix_filter(models.User.username, username)) 
     if email:
-        query = query.filter(models.User.email.ilike(f"%{email}%"))
+        query = query.filter(prefix_filter(models.User.email, email))
     if role:
         query = query.filter(models.User.role == role)
     if account_status:
@@ -413,29 +1049,47 @@ def get_users():
     if is_logged :
         query = query.filter(models.User.isLogged == (is_logged.lower() == 'true'))
     if first_name:
-        query = query.filter(models.User.first_name.ilike(f"%{first_name}%"))
+        query = query.filter(prefix_filter(models.User.first_name, first_name))
     if last_name:
-        query = query.filter(models.User.last_name.ilike(f"%{last_name}%"))
+        query = query.filter(prefix_filter(models.User.last_name, last_name))
 
-    users = query.all()
+    # Keyset pagination on the primary key , one extra row tells if there is a next page
+    users = query.filter(models.User.user_id > cursor).order_by(models.User.user_id).limit(limit + 1).all()
+    has_more = len(users) > limit
+    users = users[:limit]
 
-    user_list = [
-        {
-            "user_id": user.user_id,
-            "username": user.username,
-            "email": user.email,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "created_at": user.created_at,
-            "account_status": user.account_status,
-            "isLogged": user.isLogged,
-            "role": user.role,
-            "profile_picture": user.profile_picture
-        }
-        for user in users
-    ]
+    if autocomplete:
+        user_list = [
+            {
+                "user_id": user.user_id,
+                "username": user.username,
+                "profile_picture": user.profile_picture,
+                "profile_picture_variants": picture_variants("users", user.profile_picture)
+            }
+            for user in users
+        ]
+    else:
+        user_list = [
+            {
+                "user_id": user.user_id,
+                "username": user.username,
+                "email": user.email,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "created_at": user.created_at,
+                "account_status": user.account_status,
+                "isLogged": user.isLogged,
+                "role": user.role,
+                "profile_picture": user.profile_picture,
+                "profile_picture_variants": picture_variants("users", user.profile_picture)
+            }
+            for user in users
+        ]
 
-    return jsonify(user_list), 200
+    response = jsonify(user_list)
+    if has_more:
+        response.headers["X-Next-Cursor"] = str(users[-1].user_id)
+    return response, 200
 
 @app.route("/user/groups", methods=["GET"])
 @jwt_required()
@@ -444,22 +1098,16 @@ def get_user_groups():
     current_user = get_jwt_identity()
     user_id = current_user.get("user_id")
 
-    group_room_users = models.RoomUsers.query \
-        .join(models.Room, models.Room.room_id == models.RoomUsers.room_id) \
-        .filter(models.RoomUsers.user_id == user_id, models.Room.room_type == "group") \
-        .all()
+    rooms = get_member_rooms(user_id, "group")
 
-    if not group_room_users:
+    if not rooms:
         return jsonify({"message": "User is not a member of any group rooms"}), 404
 
-    group_rooms = []
-    for room_user in group_room_users:
-        room = models.Room.query.get(room_user.room_id)
+    users_by_room = get_room_members([room.room_id for room in rooms])
 
-        users_in_room = models.User.query \
-            .join(models.RoomUsers, models.User.user_id == models.RoomUsers.user_id) \
-            .filter(models.RoomUsers.room_id == room.room_id) \
-            .all()
+    group_rooms = []
+    for room in rooms:
+        users_in_room = users_by_room.get(room.room_id, [])
 
         user_data = [
             {
@@ -468,17 +1116,19 @@ def get_user_groups():
                 "email": user.email,
                 "first_name": user.first_name,
                 "last_name": user.last_name,
-                "profile_picture": user.profile_picture
+                "profile_picture": user.profile_picture,
+                "profile_picture_variants": picture_variants("users", user.profile_picture)
             }
             for user in users_in_room
         ]
-        room_code = create_encrypted_room_code(room.room_id , room.room_name ,cipher_suite )
+        room_code = get_room_code(room.room_id , room.room_name)
 
         group_rooms.append({
             "room_id": room.room_id,
             "room_name": room.room_name,
-            "room_code" : room_code.decode('utf-8'),
+            "room_code" : room_code,
             "room_picture" : room.room_picture,
+            "room_picture_variants" : picture_variants("rooms", room.room_picture),
             "users": user_data
         })
 
@@ -494,14 +1144,19 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
+    failures = login_audit.recent_failures(username , user_ip)
+    limits = {"username": "LOGIN_MAX_FAILURES_PER_USER", "ip": "LOGIN_MAX_FAILURES_PER_IP", "username_ip": "LOGIN_MAX_FAILURES_PER_USER_IP"}
+    if any(app.config[limit] and failures[key] >= app.config[limit] for key, limit in limits.items()):
+        # throttled attempts are not counted , the lock expires with the window
+        return jsonify({"status" : "too many failed attempts , try again later"}) , 429
+
     user_availability = models.User.query.filter_by(username=username).first()
     if user_availability : 
-        hashed_password = user_availability.password
-        is_valid = check_password_hash(hashed_password , password) 
-        if check_password_hash(hashed_password , password):
-            login_attempt = models.LoginAttempt(username , user_ip , True).json
-            mongo.db.login_attempts.insert_one(login_attempt)
-
+        is_valid , new_hash = password_service.verify(user_availability.password , password)
+        if is_valid:
+            if new_hash:
+                user_availability.password = new_hash
+            login_audit.record(models.LoginAttempt(username , user_ip , True).json)
 
             access_token = create_access_token(
                 identity={"user_id": user_availability.user_id, "username": username},
@@ -517,8 +1172,7 @@ def login():
             models.db.session.commit()
             return response, 200
                 
-    login_attempt = models.LoginAttempt(username , user_ip , False).json
-    mongo.db.login_attempts.insert_one(login_attempt)
+    login_audit.record(models.LoginAttempt(username , user_ip , False).json)
     return jsonify({"status" : "wrong credentials"}) , 401
 
 @app.route('/user/register' , methods=['POST'])
@@ -528,7 +1182,7 @@ def register():
 
     username = data.get("username")
     email = data.get("email")
-    password = generate_password_hash(data.get("password"))
+    password = data.get("password")
     last_name = data.get("last_name")
     role = data.get("role")
     first_name = data.get('first_name')
@@ -540,6 +1194,9 @@ def register():
             return jsonify({"status" : "Email already used"}) , 400
     if user_availability :
             return jsonify({"status" : "Username already used"}) , 400
+
+    # hashed once the cheap checks passed
+    password = password_service.hash(password)
     
     registration_form = models.Registration(username , email , password , first_name , last_name , role).json
     mongo.db.registration.insert_one(registration_form)
@@ -580,22 +1237,16 @@ def get_user_dms():
     current_user = get_jwt_identity()
     user_id = current_user.get("user_id")
 
-    direct_room_users = models.RoomUsers.query \
-        .join(models.Room, models.Room.room_id == models.RoomUsers.room_id) \
-        .filter(models.RoomUsers.user_id == user_id, models.Room.room_type == "direct") \
-        .all()
+    rooms = get_member_rooms(user_id, "direct")
 
-    if not direct_room_users:
+    if not rooms:
         return jsonify({"message": "User is not a member of any direct message rooms"}), 404
 
-    direct_rooms = []
-    for room_user in direct_room_users:
-        room = models.Room.query.get(room_user.room_id)
+    users_by_room = get_room_members([room.room_id for room in rooms], exclude_user_id=user_id)
 
-        users_in_room = models.User.query \
-            .join(models.RoomUsers, models.User.user_id == models.RoomUsers.user_id) \
-            .filter(models.RoomUsers.room_id == room.room_id, models.User.user_id != user_id) \
-            .all()
+    direct_rooms = []
+    for room in rooms:
+        users_in_room = users_by_room.get(room.room_id, [])
 
         user_data = [
             {
@@ -605,6 +1256,7 @@ def get_user_dms():
                 "first_name": user.first_name,
                 "last_name": user.last_name,
                 "profile_picture": user.profile_picture,
+                "profile_picture_variants": picture_variants("users", user.profile_picture),
                 "created_at" : user.created_at
             }
             for user in users_in_room
@@ -651,11 +1303,13 @@ def update_user():
             old_picture_path = os.path.join(app.config['USERS_FOLDER'], user.profile_picture)
             if os.path.exists(old_picture_path):
                 os.remove(old_picture_path)
+            thumbnail_pipeline.remove(old_picture_path, user.profile_picture)
 
         filename = secure_filename(picture.filename)
         picture_path = os.path.join(app.config['USERS_FOLDER'], filename)
 
         picture.save(picture_path)
+        thumbnail_pipeline.submit(picture_path, filename)
 
         user.profile_picture = f'{filename}'
         models.db.session.commit()
@@ -670,6 +1324,7 @@ def update_user():
         "last_name": user.last_name,
         "role": user.role,
         "profile_picture": user.profile_picture,
+        "profile_picture_variants": picture_variants("users", user.profile_picture),
         "created_at": user.created_at.isoformat()
     }
     access_token = create_access_token(identity={"username": user.username, "user_id": user_id} , expires_delta= datetime.timedelta(hours=24))
@@ -685,30 +1340,39 @@ def get_notifs():
     current_user = get_jwt_identity()
     user_id = current_user.get("user_id")
 
-    notifications =  mongo.db.Notifications.find(
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', app.config["NOTIFICATIONS_PAGE_SIZE"])), app.config["NOTIFICATIONS_MAX_PAGE_SIZE"]))
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+    # Fetch one extra document to know if there is another page
+    notifications = list(mongo.db.Notifications.find(
         {"user_id": user_id}
-    ).sort("timestamp", -1 )
-    print(notifications)
+    ).sort("timestamp", -1 ).skip(offset * limit).limit(limit + 1))
+
+    has_more = len(notifications) > limit
 
     notifications_json = []
-    for notif in notifications:
+    for notif in notifications[:limit]:
         notification_object = {
             "user_id": notif.get("user_id"),
             "room_id": notif.get("room_id"),
             "room_name": notif.get("room_name"),
+            "unread_count": notif.get("unread_count", 1),
             "timestamp": notif["timestamp"].isoformat() 
         }
-        print(notification_object)
         notifications_json.append(notification_object)
 
-    return jsonify({"notifications": notifications_json}), 200
+    return jsonify({"notifications": notifications_json, "has_more": has_more}), 200
 
 @app.route("/users/<path:name>")
 def download_users_file(name):
-    try:
-        return send_from_directory(app.config['USERS_FOLDER'], name)
-    except FileNotFoundError:
+    path = safe_join(app.config['USERS_FOLDER'], name)
+    if not path or not os.path.isfile(path):
         abort(404)
+    # Avatars keep their name when replaced , so they are cached for a while then revalidated
+    return serve_picture(path, name)
 
 @app.route("/user/dms/initiate", methods=['POST'])
 @jwt_required()
@@ -742,6 +1406,7 @@ def create_dm_room():
             "first_name": recipient.first_name,
             "last_name": recipient.last_name,
             "profile_picture": recipient.profile_picture,
+            "profile_picture_variants": picture_variants("users", recipient.profile_picture),
             "created_at" : recipient.created_at,
             "role" : recipient.role
         }
@@ -765,6 +1430,8 @@ def create_dm_room():
 
     models.db.session.commit()
 
+    room_cache.put(RoomEntry(new_room.room_id, None, "direct", {user_id, recipient.user_id}))
+
     return jsonify({
         "room_id": new_room.room_id,
         "users" : user_data
@@ -795,7 +1462,7 @@ def forgot_password():
 
         msg.html = html_content
  
-        Thread(target=send_email, args=(app, msg)).start()
+        mail_queue.submit(msg)
     
     return jsonify(
         message=f"If a user with the email '{user_email}' exists, a recovery email has been sent."
@@ -814,7 +1481,7 @@ def reset_password():
 
     if user_availability:
         pwd = data.get("password")
-        new_password = generate_password_hash(pwd)
+        new_password = password_service.hash(pwd)
         user_availability.password = new_password
 
         models.db.session.commit()
@@ -852,6 +1519,7 @@ def create_room():
         picture_path = os.path.join(room_folder_path, filename)
 
         picture.save(picture_path)
+        thumbnail_pipeline.submit(picture_path, filename)
 
         room.room_picture = f'/{room_id}/{filename}'
         models.db.session.commit()
@@ -859,7 +1527,9 @@ def create_room():
     room_user = models.RoomUsers(room_id=room_id, user_id=user_id)
     models.db.session.add(room_user)
     models.db.session.commit()
-    return jsonify({"message": "Room created successfully", "room_id": room_id, "room_picture": room.room_picture}), 201
+
+    room_cache.put(RoomEntry(room_id, room_name, room_type, {user_id}))
+    return jsonify({"message": "Room created successfully", "room_id": room_id, "room_picture": room.room_picture, "room_picture_variants": picture_variants("rooms", room.room_picture)}), 201
 
 @app.route('/room/create_direct_room', methods=['POST'])
 @jwt_required()
@@ -903,6 +1573,8 @@ def create_direct_room():
     models.db.session.add(room_user_2)
     models.db.session.commit()
 
+    room_cache.invalidate(new_room.room_id)
+
     return jsonify({
         "message": "Direct room created successfully",
         "room_id": new_room.room_id
@@ -918,6 +1590,9 @@ def upload_file(room_id):
     if file.filename == '':
         return jsonify({'error': 'No filename provided'}), 400
 
+    current_user = get_jwt_identity()
+    user_id = current_user.get("user_id")
+
     file.seek(0, os.SEEK_END)  # Move to the end of the file
     file_size = file.tell()  # Get the size of the file
     file.seek(0)  # Reset the file pointer to the beginning
@@ -930,71 +1605,219 @@ def upload_file(room_id):
     
     filename = secure_filename(file.filename)
 
-    room_folder = os.path.join(app.config["ROOMS_FOLDER"], str(room_id))
-    os.makedirs(room_folder, exist_ok=True)
-    save_path = os.path.join(room_folder, filename)
+    checksum, file_size = offload(blob_store.store_stream, file.stream)
+    thumbnail_pipeline.submit(blob_store.path(checksum), filename)
+    content_type = file.mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
 
-    file.save(save_path)
+    attachment = record_attachment(room_id , filename , file_size , content_type , checksum , user_id)
 
-    file_size = os.path.getsize(save_path)
+    return jsonify(attachment_payload(room_id, attachment)), 200
 
-    file_url = f"http://192.168.100.9:16000/static/files/rooms/{room_id}/{filename}"
-    
+@app.route('/room/upload/<int:room_id>/init', methods=['POST'])
+@jwt_required()
+def init_chunked_upload(room_id):
+    current_user = get_jwt_identity()
+    user_id = current_user.get("user_id")
+
+    data = request.get_json()
+    name = data.get('name')
+    size = data.get('size')
+
+    if not name:
+        return jsonify({'error': 'No filename provided'}), 400
+
+    if not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'File size is required'}), 400
+
+    # Rejected before a single byte of the file is sent
+    if size > app.config["MAX_SIZE"]:
+        return jsonify({'error': 'File size exceeds 100 MB'}), 400
+
+    if not allowed_file(name):
+        return jsonify({'error': 'File type not allowed'}), 400
+
+    checksum = data.get('sha256')
+    if checksum is not None and not is_sha256(checksum):
+        return jsonify({'error': 'sha256 must be a lowercase hex digest'}), 400
+
+    # Content already on the server , no need to send it again. Only for files the user can already
+    # read , otherwise knowing a hash would be enough to copy any room's file
+    if checksum and user_has_blob(user_id, checksum) and blob_store.exists(checksum) and os.path.getsize(blob_store.path(checksum)) == size:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        attachment = record_attachment(room_id , secure_filename(name) , size , content_type , checksum , user_id)
+        return jsonify({
+            'upload_id': None,
+            'complete': True,
+            'attachment': attachment_payload(room_id, attachment)
+        }), 200
+
+    upload = models.Upload(chunk_store.new_upload_id() , room_id , user_id , secure_filename(name) , size , chunk_store.chunk_size , checksum).json
+    mongo.db.Uploads.insert_one(upload)
+
+    return jsonify({
+        'upload_id': upload['upload_id'],
+        'chunk_size': upload['chunk_size'],
+        'total_chunks': chunk_store.total_chunks(size)
+    }), 201
+
+@app.route('/room/upload/<int:room_id>/<upload_id>', methods=['GET'])
+@jwt_required()
+def get_chunked_upload(room_id, upload_id):
+    upload, error = find_upload(room_id, upload_id)
+    if error:
+        return error
+
+    # Lets a client resume after a disconnect by sending only the missing chunks
+    received = chunk_store.received(upload_id)
+    total_chunks = chunk_store.total_chunks(upload['size'])
     return jsonify({
-        'link': file_url,
-        'name': filename,
-        'size': file_size
+        'upload_id': upload_id,
+        'chunk_size': upload['chunk_size'],
+        'total_chunks': total_chunks,
+        'received': received,
+        'missing': sorted(set(range(total_chunks)) - set(received))
     }), 200
 
+@app.route('/room/upload/<int:room_id>/<upload_id>/<int:index>', methods=['PUT'])
+@jwt_required()
+def put_upload_chunk(room_id, upload_id, index):
+    upload, error = find_upload(room_id, upload_id)
+    if error:
+        return error
+
+    if index >= chunk_store.total_chunks(upload['size']):
+        return jsonify({'error': 'Chunk index out of range'}), 400
+
+    expected_length = chunk_store.expected_length(upload['size'], index)
+    if request.content_length is not None and request.content_length != expected_length:
+        return jsonify({'error': f'Chunk {index} must be {expected_length} bytes'}), 400
+
+    try:
+        chunk_store.write_chunk(upload_id, index, request.stream, expected_length)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'index': index, 'size': expected_length}), 200
+
+@app.route('/room/upload/<int:room_id>/<upload_id>/complete', methods=['POST'])
+@jwt_required()
+def complete_chunked_upload(room_id, upload_id):
+    upload, error = find_upload(room_id, upload_id)
+    if error:
+        return error
+
+    try:
+        assembled_path, file_size, checksum = offload(chunk_store.assemble, upload_id, chunk_store.total_chunks(upload['size']))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if file_size != upload['size'] or (upload.get('sha256') and upload['sha256'] != checksum):
+        chunk_store.discard(upload_id)
+        mongo.db.Uploads.delete_one({'upload_id': upload_id})
+        return jsonify({'error': 'Uploaded file does not match its declared size or checksum'}), 400
+
+    filename = upload['name']
+    blob_store.store_file(assembled_path, checksum)
+    thumbnail_pipeline.submit(blob_store.path(checksum), filename)
+
+    chunk_store.discard(upload_id)
+    mongo.db.Uploads.delete_one({'upload_id': upload_id})
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    attachment = record_attachment(room_id , filename , file_size , content_type , checksum , upload['user_id'])
+
+    return jsonify(attachment_payload(room_id, attachment)), 200
+
 @app.route('/room/messages/<int:room_id>', methods=['GET'])
 @jwt_required()
 def get_room_messages(room_id):
     current_user = get_jwt_identity()
     user_id = current_user.get("user_id")
 
-    offset = int(request.args.get('offset', 0))
+    before = request.args.get('before')
+    after = request.args.get('after')
 
-    skip = offset * 20
+    try:
+        limit = max(1, min(int(request.args.get('limit', app.config["MESSAGES_PAGE_SIZE"])), app.config["MESSAGES_MAX_PAGE_SIZE"]))
+        if before:
+            # Older messages than the cursor , newest first
+            timestamp, message_id = decode_cursor(before, 'timestamp')
+            query = {'room_id': room_id, '$or': [
+                {'timestamp': {'$lt': timestamp}},
+                {'timestamp': timestamp, '_id': {'$lt': message_id}}
+            ]}
+            messages = list(mongo.db.UserMessages.find(query).sort([('timestamp', -1), ('_id', -1)]).limit(limit))
+        elif after:
+            # Newer messages than the cursor , fetched oldest first then flipped to keep the page newest first
+            timestamp, message_id = decode_cursor(after, 'timestamp')
+            query = {'room_id': room_id, '$or': [
+                {'timestamp': {'$gt': timestamp}},
+                {'timestamp': timestamp, '_id': {'$gt': message_id}}
+            ]}
+            messages = list(mongo.db.UserMessages.find(query).sort([('timestamp', 1), ('_id', 1)]).limit(limit))
+            messages.reverse()
+        else:
+            # Page number pagination , kept for older clients
+            offset = int(request.args.get('offset', 0))
+            messages = list(mongo.db.UserMessages.find(
+                {'room_id': room_id}
+            ).sort([('timestamp', -1), ('_id', -1)]).skip(offset * limit).limit(limit))
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+    message_list = [message_payload(message) for message in messages]
 
-    messages = mongo.db.UserMessages.find(
-        {'room_id': room_id}
-    ).sort('timestamp', -1).skip(skip).limit(20)
+    return jsonify({
+        'messages': message_list,
+        'next_cursor': encode_cursor(messages[-1], 'timestamp') if messages else None,
+        'prev_cursor': encode_cursor(messages[0], 'timestamp') if messages else None
+    }), 200
 
-    # Function to get file size
-    def get_file_size(file_path):
-        try:
-            return os.path.getsize(file_path)
-        except FileNotFoundError:
-            return None
-
-    base_folder = os.path.join(app.config["ROOMS_FOLDER"], str(room_id))
-
-    message_list = []
-    for message in messages:
-        message_data = {
-            'user_id': message['sender_id'],
-            'room_id': message['room_id'],
-            'message': message['message'],
-            'message_type': message['message_type'],
-            'timestamp': message['timestamp']
-        }
+@app.route('/room/search/<int:room_id>', methods=['GET'])
+@jwt_required()
+@limiter.limit("30 per minute")
+def search_room_messages(room_id):
+    current_user = get_jwt_identity()
+    user_id = current_user.get("user_id")
 
-        if 'attachments' in message:
-            print(message["attachments"])
-            attachment_name = message['attachments']["name"]
-            file_path = os.path.join(base_folder, attachment_name)
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'Search text is required'}), 400
 
-            message_data['attachments'] = {
-                'name': attachment_name,
-                'link': f"http://192.168.100.9:16000/static/files/rooms/{room_id}/{attachment_name}",
-                'size': get_file_size(file_path)
-            }
+    if not models.RoomUsers.query.filter_by(user_id=user_id, room_id=room_id).first():
+        return jsonify({'error': 'User is not a member of this room'}), 403
 
-        message_list.append(message_data)
+    try:
+        limit = max(1, min(int(request.args.get('limit', app.config["SEARCH_PAGE_SIZE"])), app.config["SEARCH_MAX_PAGE_SIZE"]))
+        results = search_messages([room_id], text, limit, request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
 
-    return jsonify({
-        'messages': message_list
-    }), 200
+    return jsonify(results), 200
+
+@app.route('/room/search', methods=['GET'])
+@jwt_required()
+@limiter.limit("30 per minute")
+def search_all_messages():
+    current_user = get_jwt_identity()
+    user_id = current_user.get("user_id")
+
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'Search text is required'}), 400
+
+    # Only the rooms the caller belongs to
+    room_ids = [room_user.room_id for room_user in models.RoomUsers.query.filter_by(user_id=user_id).all()]
+    if not room_ids:
+        return jsonify({'messages': [], 'next_cursor': None}), 200
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', app.config["SEARCH_PAGE_SIZE"])), app.config["SEARCH_MAX_PAGE_SIZE"]))
+        results = search_messages(room_ids, text, limit, request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+    return jsonify(results), 200
 
 @app.route('/room/leave', methods=['POST'])
 @jwt_required()
@@ -1015,6 +1838,8 @@ def leave_group():
         models.db.session.delete(room_user_entry)
         models.db.session.commit()
 
+        room_cache.remove_member(int(room_id), user_id)
+
         # Check if any users remain in the room
         remaining_users = models.RoomUsers.query.filter_by(room_id=room_id).count()
         if remaining_users == 0:
@@ -1028,8 +1853,10 @@ def leave_group():
                 if os.path.exists(room_folder):
                     # Remove the folder and its contents
                     shutil.rmtree(room_folder)
+                delete_room_attachments(int(room_id))
 
             models.db.session.commit()
+            room_cache.invalidate(int(room_id))
 
         return jsonify({"message": "Successfully left the group"}), 200
 
@@ -1069,6 +1896,8 @@ def join_group() :
         models.db.session.add(new_room_user)
         models.db.session.commit()
 
+        room_cache.add_member(room_id, user_id)
+
         return jsonify({
             "message": f"You have successfully joined the room: {room_name}"}), 200
     except Exception as e:
@@ -1078,14 +1907,141 @@ def join_group() :
 
 @app.route("/rooms/<room_id>/<name>")
 def get_room_file(room_id, name):
-    try:
-        directory_path = os.path.join(app.config['ROOMS_FOLDER'], room_id)
-        return send_from_directory(directory_path, name)
-    except FileNotFoundError:
+    attachment = None
+    if room_id.isdigit():
+        attachment = mongo.db.Attachments.find_one({"room_id": int(room_id), "name": name})
+    if attachment and attachment.get("sha256") and blob_store.exists(attachment["sha256"]):
+        blob_path = blob_store.path(attachment["sha256"])
+        if request.args.get('size'):
+            variant = requested_variant(blob_path, name)
+            if not variant:
+                # Thumbnail not ready yet , the original must not be cached under the thumbnail url
+                return serve_file(blob_path, name, mimetype=attachment.get("content_type"), max_age=0)
+            return serve_file(
+                variant, os.path.basename(variant),
+                etag=f"{attachment['sha256']}-{request.args['size']}",
+                max_age=app.config["BLOB_FILES_MAX_AGE"],
+                immutable=True
+            )
+        # A (room , name) never changes content , the sha256 is a strong validator
+        return serve_file(
+            blob_store.path(attachment["sha256"]), name,
+            mimetype=attachment.get("content_type"),
+            etag=attachment["sha256"],
+            max_age=app.config["BLOB_FILES_MAX_AGE"],
+            immutable=True
+        )
+
+    # Room pictures and files stored before blobs
+    path = safe_join(app.config['ROOMS_FOLDER'], room_id, name)
+    if not path or not os.path.isfile(path):
         abort(404)
+    return serve_picture(path, name)
+
+
+@app.route("/metrics")
+@limiter.exempt
+def prometheus_metrics():
+    """Prometheus text format , every worker serves its own numbers."""
+    if app.config["METRICS_TOKEN"] and request.headers.get("Authorization") != f"Bearer {app.config['METRICS_TOKEN']}":
+        abort(401)
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def profiling_admin_required(view):
+    """Routes only reachable with "Authorization: Bearer <PROFILING_TOKEN>" , and not at all without a token."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config["PROFILING_TOKEN"]:
+            abort(404)
+        if request.headers.get("Authorization") != f"Bearer {app.config['PROFILING_TOKEN']}":
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/admin/profiling", methods=["GET"])
+@limiter.exempt
+@profiling_admin_required
+def profiling_status():
+    request_profiler.dump()
+    return jsonify({"requests": request_profiler.stats, "capture": stack_sampler.stats}), 200
+
+@app.route("/admin/profiling/start", methods=["POST"])
+@limiter.exempt
+@profiling_admin_required
+def start_profiling():
+    """Starts a time boxed sampling capture , sample_rate optionally runs cProfile on that fraction of the calls until it ends."""
+    data = request.get_json(silent=True) or {}
+    try:
+        duration = float(data.get("duration", 30))
+        sample_rate = data.get("sample_rate")
+        sample_rate = None if sample_rate is None else float(sample_rate)
+    except (TypeError, ValueError):
+        return jsonify({"message": "duration and sample_rate must be numbers"}), 400
+    if duration <= 0 or (sample_rate is not None and not 0 <= sample_rate <= 1):
+        return jsonify({"message": "duration must be positive and sample_rate between 0 and 1"}), 400
+
+    if not stack_sampler.start(duration):
+        return jsonify({"message": "A capture is already running"}), 409
+    if sample_rate is not None:
+        request_profiler.sample_rate = sample_rate
+    return jsonify({"capture": stack_sampler.stats}), 200
+
+@app.route("/admin/profiling/stop", methods=["POST"])
+@limiter.exempt
+@profiling_admin_required
+def stop_profiling():
+    """Ends the capture early , it writes its collapsed stacks and restores PROFILE_SAMPLE_RATE."""
+    folder = stack_sampler.stop()
+    request_profiler.dump()
+    return jsonify({"capture": folder, "requests": request_profiler.stats}), 200
+
+
+def create_mongo_indexes():
+    """create_indexes() , after migrating the notifications of older deployments when their unique index is missing."""
+    if "user_id_1_room_id_1" not in mongo.db.Notifications.index_information():
+        removed = collapse_notifications(mongo.db)
+        if removed:
+            print(f"Collapsed {removed} legacy notifications into unread counters")
+    return create_indexes(mongo.db, mongo_indexes)
+
+@app.cli.command("create-indexes")
+def create_indexes_command():
+    """Creates the Mongo indexes declared in indexes.py and audit.py and the SQL indexes declared in models.py."""
+    for collection, names in create_mongo_indexes().items():
+        print(f"{collection}: {', '.join(names)}")
+    for table in models.db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(models.db.engine, checkfirst=True)
+            print(f"{table.name}: {index.name}")
+
+@app.cli.command("collapse-notifications")
+def collapse_notifications_command():
+    """Folds the one-per-message notifications of older versions into one unread counter per user and room."""
+    print(f"{collapse_notifications(mongo.db)} legacy notifications removed")
+
+@app.cli.command("sweep-attachments")
+def sweep_attachments_command():
+    """Flags attachments whose file no longer exists on disk."""
+    print(f"{sweep_attachments()} missing attachments flagged")
+
+@app.cli.command("expire-uploads")
+def expire_uploads_command():
+    """Drops chunked uploads older than UPLOAD_EXPIRY."""
+    print(f"{expire_uploads()} expired uploads removed")
+
+@app.cli.command("verify-indexes")
+def verify_indexes_command():
+    """Explains every hot query and fails if one of them does a collection scan."""
+    collscans = verify_indexes(mongo.db)
+    if collscans:
+        raise click.ClickException(f"COLLSCAN in: {', '.join(collscans)}")
+    print("All hot queries use an index")
 
 
 if __name__ == '__main__':
-    socketio.run(app , host='192.168.100.9', port=16000 , debug=True )
+    if app.config["MONGO_CREATE_INDEXES"]:
+        create_mongo_indexes()
+    socketio.run(app , host=os.getenv("INSYNC_HOST", '192.168.100.9'), port=int(os.getenv("INSYNC_PORT", 16000)) , debug=os.getenv("INSYNC_DEBUG", "1") == "1" )
 
 
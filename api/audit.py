@@ -0,0 +1,140 @@
+from collections import Counter
+from datetime import datetime , timedelta , timezone
+from threading import Lock
+
+from pymongo import ASCENDING , DESCENDING , UpdateOne
+from pymongo.errors import PyMongoError
+
+from indexes import IndexSpec
+from writebehind import WriteBehindWriter
+
+
+def counter_keys(attempt):
+    return [
+        f"username:{attempt['username']}",
+        f"ip:{attempt['ip_address']}",
+        f"username_ip:{attempt['username']}|{attempt['ip_address']}"
+    ]
+
+
+class LoginAuditLog(WriteBehindWriter):
+    """Login attempts written in batches , plus per username , per ip and per ( username , ip ) counters
+    for brute force detection.
+
+    Attempts go to the attempts collection and expire after retention seconds ( TTL index ).
+    Every batch also upserts one counter document per ( key , window ) in the counters collection ,
+    so checking the recent failures of a username or an ip reads at most two small documents
+    instead of scanning the attempts. Counters expire once their window is over.
+    """
+    def __init__(self, get_collection, get_counters, retention=30 * 24 * 3600, window=15 * 60, **options):
+        super().__init__(get_collection, **options)
+        self.get_counters = get_counters
+        self.retention = retention
+        self.window = window
+        # failures submitted but not flushed yet , so a burst is seen before its batch is written
+        self._pending = Counter()
+        self._pending_lock = Lock()
+
+    def indexes(self):
+        """Index specs of both collections , for create_indexes()."""
+        return {
+            "login_attempts": [
+                IndexSpec([("username", ASCENDING), ("attempt_time", DESCENDING)]),
+                IndexSpec([("ip_address", ASCENDING), ("attempt_time", DESCENDING)]),
+                IndexSpec([("attempt_time", ASCENDING)], expireAfterSeconds=self.retention),
+            ],
+            "LoginCounters": [
+                IndexSpec([("key", ASCENDING), ("window", DESCENDING)], unique=True),
+                IndexSpec([("expires_at", ASCENDING)], expireAfterSeconds=0),
+            ],
+        }
+
+    def window_start(self, moment):
+        seconds = int(moment.timestamp())
+        return datetime.fromtimestamp(seconds - seconds % self.window, timezone.utc)
+
+    def record(self, attempt):
+        if not attempt["success"]:
+            with self._pending_lock:
+                self._pending.update(counter_keys(attempt))
+        try:
+            self.submit(attempt)
+        except PyMongoError as e:
+            # the buffer was full and Mongo is down , losing the record must not fail the login
+            print(f"login audit: could not record attempt: {e}")
+
+    def recent_failures(self, username, ip_address):
+        """Failed attempts of the username , of the ip and of the pair during the current and the previous window."""
+        keys = dict(zip(("username", "ip", "username_ip"), counter_keys({"username": username, "ip_address": ip_address})))
+        since = self.window_start(datetime.now(timezone.utc)) - timedelta(seconds=self.window)
+        with self._pending_lock:
+            failures = {name: self._pending[key] for name, key in keys.items()}
+
+        try:
+            counters = self.get_counters().find(
+                {"key": {"$in": list(keys.values())}, "window": {"$gte": since}},
+                {"key": 1, "failures": 1}
+            )
+            for counter in counters:
+                for name, key in keys.items():
+                    if counter["key"] == key:
+                        failures[name] += counter.get("failures", 0)
+        except PyMongoError as e:
+            # never lock everybody out because the counters can't be read
+            print(f"login audit: could not read counters: {e}")
+        return failures
+
+    @property
+    def stats(self):
+        stats = super().stats
+        stats["pending_failures"] = sum(self._pending.values())
+        return stats
+
+    def _insert_now(self, document):
+        # on the request thread : one attempt , no retries
+        try:
+            super()._insert_now(document)
+        except PyMongoError:
+            self._release_pending([document])
+            raise
+        self._update_counters([document])
+
+    def _write(self, batch):
+        super()._write(batch)
+        self._update_counters(batch)
+
+    def _release_pending(self, batch):
+        with self._pending_lock:
+            for attempt in batch:
+                if not attempt["success"]:
+                    self._pending.subtract(counter_keys(attempt))
+            self._pending = +self._pending
+
+    def _update_counters(self, batch):
+        increments = {}
+        for attempt in batch:
+            window = self.window_start(attempt["attempt_time"])
+            field = "successes" if attempt["success"] else "failures"
+            for key in counter_keys(attempt):
+                counter = increments.setdefault((key, window), Counter())
+                counter[field] += 1
+
+        operations = [
+            UpdateOne(
+                {"key": key, "window": window},
+                {
+                    "$inc": dict(counts),
+                    "$setOnInsert": {"expires_at": window + timedelta(seconds=2 * self.window)}
+                },
+                upsert=True
+            )
+            for (key, window), counts in increments.items()
+        ]
+        try:
+            if operations:
+                self.get_counters().bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            self.failures += 1
+            print(f"login audit: could not update counters: {e}")
+        finally:
+            self._release_pending(batch)
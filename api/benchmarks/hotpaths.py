@@ -0,0 +1,433 @@
+"""Micro-benchmarks of the chat hot paths , offline and reproducible.
+
+The app runs in process against SQLite and mongomock ( or a local mongod with --mongo-uri ) , seeded
+with a synthetic dataset built from --seed , so two runs with the same options time the same work :
+
+    python benchmarks/hotpaths.py run --output before.json
+    ... change something ...
+    python benchmarks/hotpaths.py run --output after.json --baseline before.json --threshold 0.15
+
+    python benchmarks/hotpaths.py compare before.json after.json --threshold 0.15
+
+Scenarios : sendMessage fan-out to a room with online , joined and offline members , the latest page and
+a cursor walk of /room/messages , /user/groups , /user/dms , /user/users search and upload_file.
+Every scenario runs --warmup untimed iterations then --iterations timed ones. The compare step
+flags a scenario as a regression when its --metric ( p50_ms by default ) grew by more than
+--threshold ( a fraction ) and exits with status 1 , compare results of the same machine only.
+
+The SQL database and the Mongo database ( --mongo-db ) are wiped before seeding , never point
+them at data you want to keep. Requests go through Flask's test client and Flask-SocketIO's
+test client , so the timings cover the handlers and the databases , not the network.
+"""
+import argparse , gc , json , os , platform , random , shutil , subprocess , sys , tempfile , time
+from datetime import datetime , timedelta , timezone
+from io import BytesIO
+
+
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_NAMES = ["Amina", "Youssef", "Lina", "Omar", "Sara", "Karim", "Nour", "Adam", "Ines", "Rayan", "Maya", "Ilyes"]
+LAST_NAMES = ["Benali", "Haddad", "Mansouri", "Cherif", "Kaci", "Bouzid", "Saidi", "Amrani", "Toumi", "Rahmani"]
+WORDS = ["meeting", "deadline", "report", "lunch", "deploy", "review", "slides", "budget", "call", "ticket", "draft", "ok"]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 3)
+
+
+def summarize(timings):
+    mean = sum(timings) / len(timings)
+    return {
+        "iterations": len(timings),
+        "mean_ms": round(mean * 1000, 3),
+        "p50_ms": percentile(timings, 0.5),
+        "p95_ms": percentile(timings, 0.95),
+        "p99_ms": percentile(timings, 0.99),
+        "min_ms": round(min(timings) * 1000, 3),
+        "max_ms": round(max(timings) * 1000, 3),
+        "ops_per_s": round(1 / mean, 1) if mean else None
+    }
+
+
+def measure(run, iterations, warmup, after=None):
+    """Times run() , after() is called between iterations outside of the timing."""
+    for _ in range(warmup):
+        run()
+        if after:
+            after()
+    gc.collect()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+        if after:
+            after()
+    return summarize(timings)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_FOLDER, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_app(args, folder):
+    """Imports app.py configured for the benchmark , the environment has to be set before the import."""
+    os.environ["POSTGRES_URI"] = args.sql_uri
+    os.environ["MONGO_URI"] = args.mongo_uri or "mongodb://127.0.0.1:27017"
+    os.environ["INSYNC_ASYNC_MODE"] = "threading"
+    os.environ["MONGO_CREATE_INDEXES"] = "0"
+    os.environ["UPLOADS_TMP_FOLDER"] = os.path.join(folder, "uploads_tmp")
+    os.environ["PROFILE_FOLDER"] = os.path.join(folder, "profiles")
+    # background work that would run during the timings , override from the environment to measure with it
+    for name, value in (("QUERY_TRACING", "0"), ("ATTACHMENT_SWEEP_INTERVAL", "0"), ("PASSWORD_HASH_WORKERS", "0"),
+                        ("PRESENCE_SNAPSHOT_INTERVAL", "0"), ("POOL_STATS_INTERVAL", "0")):
+        os.environ.setdefault(name, value)
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret-key")
+    if not os.environ.get("ROOM_KEY"):
+        from cryptography.fernet import Fernet
+        os.environ["ROOM_KEY"] = Fernet.generate_key().decode()
+
+    sys.path.insert(0, API_FOLDER)
+    import app as api
+
+    api.app.config["TESTING"] = True
+    # identities are dicts , newer Flask-JWT-Extended only accepts them without the "sub" check
+    api.app.config["JWT_VERIFY_SUB"] = False
+    api.limiter.enabled = False
+    api.app.config["ROOMS_FOLDER"] = os.path.join(folder, "rooms")
+    api.app.config["USERS_FOLDER"] = os.path.join(folder, "users")
+    api.blob_store.folder = os.path.join(folder, "blobs")
+    for path in (api.app.config["ROOMS_FOLDER"], api.app.config["USERS_FOLDER"], api.blob_store.folder):
+        os.makedirs(path, exist_ok=True)
+
+    if args.mongo_uri:
+        api.mongo.db = api.mongo.cx[args.mongo_db]
+        api.mongo.cx.drop_database(args.mongo_db)
+    else:
+        api.mongo.db = mongomock_database(args.mongo_db)
+    return api
+
+
+def mongomock_database(name):
+    import mongomock
+    from pymongo import InsertOne , UpdateOne
+
+    def bulk_write(collection, requests, ordered=True, **kwargs):
+        # mongomock's bulk_write doesn't accept the operations of recent PyMongo releases , apply them one by one
+        for operation in requests:
+            if isinstance(operation, UpdateOne):
+                collection.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+            elif isinstance(operation, InsertOne):
+                collection.insert_one(operation._doc)
+            else:
+                raise NotImplementedError(f"{type(operation).__name__} is not supported on mongomock")
+
+    mongomock.Collection.bulk_write = bulk_write
+    return mongomock.MongoClient()[name]
+
+
+class Dataset:
+    """Users , group and direct rooms and message history , the same for the same options.
+
+    User 1 is the benchmarked user , member of --user-groups groups and --user-dms direct rooms.
+    Room 1 is the hot room : --room-size members , a quarter of the messages and the sendMessage target.
+    """
+    def __init__(self, api, args):
+        self.api = api
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.hot_room_id = None
+        self.hot_room_members = []
+
+    def seed(self):
+        models = self.api.models
+        with self.api.app.app_context():
+            models.db.drop_all()
+            models.db.create_all()
+            self._seed_sql(models)
+        self.api.create_indexes(self.api.mongo.db, self.api.mongo_indexes)
+        self._seed_messages()
+
+    def _seed_sql(self, models):
+        args = self.args
+        password = "pbkdf2:sha256:1$bench$" + "0" * 64  # nobody logs in , no need to hash
+        created_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        models.db.session.execute(models.User.__table__.insert(), [
+            {
+                "user_id": user_id,
+                "username": f"{self.random.choice(FIRST_NAMES).lower()}{user_id}",
+                "password": password,
+                "email": f"user{user_id}@bench.local",
+                "first_name": self.random.choice(FIRST_NAMES),
+                "last_name": self.random.choice(LAST_NAMES),
+                "created_at": created_at,
+                "account_status": "active",
+                "isLogged": False,
+                "role": self.random.choice(["student", "teacher", "admin"])
+            }
+            for user_id in range(1, args.users + 1)
+        ])
+
+        others = range(2, args.users + 1)
+        rooms , memberships = [], []
+        room_id = 0
+        for index in range(args.groups):
+            room_id += 1
+            rooms.append({"room_id": room_id, "room_type": "group", "room_name": f"group {room_id}", "created_at": created_at})
+            size = args.room_size if index == 0 else args.group_size
+            members = {1} if index < args.user_groups else set()
+            members.update(self.random.sample(others, min(len(others), size - len(members))))
+            memberships.extend({"room_id": room_id, "user_id": user_id} for user_id in members)
+            if index == 0:
+                self.hot_room_id = room_id
+                self.hot_room_members = sorted(members)
+        for recipient in self.random.sample(others, min(len(others), args.user_dms)):
+            room_id += 1
+            rooms.append({"room_id": room_id, "room_type": "direct", "room_name": None, "created_at": created_at})
+            memberships.extend([{"room_id": room_id, "user_id": 1}, {"room_id": room_id, "user_id": recipient}])
+        models.db.session.execute(models.Room.__table__.insert(), rooms)
+        models.db.session.execute(models.RoomUsers.__table__.insert(), memberships)
+        models.db.session.commit()
+        self.room_ids = [room["room_id"] for room in rooms if room["room_type"] == "group"]
+
+    def _seed_messages(self):
+        args = self.args
+        started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        messages = []
+        for index in range(args.messages):
+            room_id = self.hot_room_id if index % 4 == 0 else self.random.choice(self.room_ids)
+            messages.append({
+                "sender_id": self.random.choice(self.hot_room_members) if room_id == self.hot_room_id else self.random.randint(1, args.users),
+                "room_id": room_id,
+                "timestamp": started + timedelta(seconds=index * 7),
+                "message": " ".join(self.random.choices(WORDS, k=self.random.randint(2, 12))),
+                "message_type": "text"
+            })
+            if len(messages) == 5000:
+                self.api.mongo.db.UserMessages.insert_many(messages)
+                messages = []
+        if messages:
+            self.api.mongo.db.UserMessages.insert_many(messages)
+
+
+class Scenarios:
+    def __init__(self, api, dataset, args, folder):
+        self.api = api
+        self.dataset = dataset
+        self.args = args
+        self.folder = folder
+        self.client = api.app.test_client()
+        self.headers = {"Authorization": f"Bearer {self.token(1)}"}
+
+    def token(self, user_id):
+        with self.api.app.app_context():
+            return self.api.create_access_token(identity={"user_id": user_id, "username": f"bench{user_id}"})
+
+    def get(self, url):
+        response = self.client.get(url, headers=self.headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} answered {response.status_code} : {response.get_data(as_text=True)[:200]}")
+        return response
+
+    def run(self, only=None):
+        scenarios = {
+            "send_message_fanout": self.send_message_fanout,
+            "room_messages_latest": self.room_messages_latest,
+            "room_messages_paging": self.room_messages_paging,
+            "user_groups": self.user_groups,
+            "user_dms": self.user_dms,
+            "user_search": self.user_search,
+            "upload_file": self.upload_file
+        }
+        results = {}
+        for name, scenario in scenarios.items():
+            if only and name not in only:
+                continue
+            results[name] = scenario()
+            print(f"{name:<24} p50 {results[name]['p50_ms']:>9.3f} ms   p95 {results[name]['p95_ms']:>9.3f} ms   "
+                  f"{results[name]['ops_per_s']:>8} ops/s")
+        return results
+
+    def send_message_fanout(self):
+        """The sender and --online other members are connected , half of those joined the room ,
+        the other half get a realtime notification and the offline members a stored one."""
+        room_id = self.dataset.hot_room_id
+        online = [user_id for user_id in self.dataset.hot_room_members if user_id != 1][:self.args.online]
+        clients = [self.api.socketio.test_client(self.api.app, query_string=f"token={self.token(user_id)}") for user_id in [1] + online]
+        sender = clients[0]
+        for client in clients[:1 + len(online) // 2]:
+            client.emit("joinRoom", {"room_id": room_id})
+        payload = {"room_id": room_id, "message": "benchmark message"}
+
+        def drain():
+            for client in clients:
+                client.get_received()
+        drain()
+        try:
+            result = measure(lambda: sender.emit("sendMessage", payload), self.args.iterations, self.args.warmup, drain)
+        finally:
+            for client in clients:
+                client.disconnect()
+        result["fanout"] = {
+            "joined": 1 + len(online) // 2,
+            "notified_online": len(online) - len(online) // 2,
+            "notified_offline": len(self.dataset.hot_room_members) - 1 - len(online)
+        }
+        return result
+
+    def room_messages_latest(self):
+        url = f"/room/messages/{self.dataset.hot_room_id}?limit={self.args.page_size}"
+        return measure(lambda: self.get(url), self.args.iterations, self.args.warmup)
+
+    def room_messages_paging(self):
+        """Walks the hot room's history with the before cursor , back to the latest page at the end."""
+        url = f"/room/messages/{self.dataset.hot_room_id}?limit={self.args.page_size}"
+        cursor = {"before": None}
+
+        def next_page():
+            page = self.get(url + (f"&before={cursor['before']}" if cursor["before"] else "")).get_json()
+            cursor["before"] = page["next_cursor"] if len(page["messages"]) == self.args.page_size else None
+        return measure(next_page, self.args.iterations, self.args.warmup)
+
+    def user_groups(self):
+        return measure(lambda: self.get("/user/groups"), self.args.iterations, self.args.warmup)
+
+    def user_dms(self):
+        return measure(lambda: self.get("/user/dms"), self.args.iterations, self.args.warmup)
+
+    def user_search(self):
+        """Autocomplete and full searches , rotating over name prefixes."""
+        terms = [name[:length].lower() for name in FIRST_NAMES + LAST_NAMES for length in (1, 3)]
+        urls = [f"/user/users?q={term}&autocomplete={'1' if index % 2 else '0'}" for index, term in enumerate(terms)]
+        position = {"index": 0}
+
+        def search():
+            self.get(urls[position["index"] % len(urls)])
+            position["index"] += 1
+        return measure(search, self.args.iterations, self.args.warmup)
+
+    def upload_file(self):
+        """Distinct content every time , so each upload stores a new blob."""
+        room_id = self.dataset.hot_room_id
+        generator = random.Random(self.args.seed)
+        payloads = [generator.randbytes(self.args.upload_kb * 1024) for _ in range(self.args.warmup + self.args.iterations)]
+        position = {"index": 0}
+
+        def upload():
+            index = position["index"]
+            position["index"] += 1
+            response = self.client.post(f"/room/upload/{room_id}", headers=self.headers, content_type="multipart/form-data",
+                                        data={"file": (BytesIO(payloads[index]), f"report-{index}.pdf")})
+            if response.status_code != 200:
+                raise RuntimeError(f"upload answered {response.status_code} : {response.get_data(as_text=True)[:200]}")
+        return measure(upload, self.args.iterations, self.args.warmup)
+
+
+def compare(baseline, current, threshold, metric):
+    """Prints the change of every scenario , returns the names of the regressed ones."""
+    if baseline.get("dataset") != current.get("dataset"):
+        print("warning : the runs used different datasets , the numbers are not comparable")
+    regressions = []
+    print(f"{'scenario':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in current["results"].items():
+        previous = baseline["results"].get(name)
+        if not previous or not previous.get(metric):
+            print(f"{name:<24} {'-':>10} {result[metric]:>10.3f}      new")
+            continue
+        change = result[metric] / previous[metric] - 1
+        status = ""
+        if change > threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            status = "faster"
+        print(f"{name:<24} {previous[metric]:>10.3f} {result[metric]:>10.3f} {change:>+8.1%}  {status}")
+    return regressions
+
+
+def run(args):
+    folder = tempfile.mkdtemp(prefix="insync-bench-")
+    try:
+        api = load_app(args, folder)
+        dataset = Dataset(api, args)
+        started = time.perf_counter()
+        dataset.seed()
+        print(f"seeded {args.users} users , {args.groups} groups , {args.user_dms} direct rooms and {args.messages} messages "
+              f"in {time.perf_counter() - started:.1f} s")
+        results = Scenarios(api, dataset, args, folder).run(args.only)
+        if args.mongo_uri:
+            api.mongo.cx.drop_database(args.mongo_db)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backends": {"sql": args.sql_uri.split(":", 1)[0], "mongo": "mongod" if args.mongo_uri else "mongomock"},
+        "dataset": {key: getattr(args, key) for key in ("seed", "users", "groups", "group_size", "room_size", "user_groups",
+                                                        "user_dms", "messages", "online", "page_size", "upload_kb")},
+        "iterations": args.iterations,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            return 1 if compare(json.load(baseline), report, args.threshold, args.metric) else 0
+    return 0
+
+
+def add_compare_options(parser):
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown , 0.15 is 15 percent")
+    parser.add_argument("--metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms", "min_ms"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the chat hot paths , offline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed a dataset and time the scenarios")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--users", type=int, default=2000)
+    run_parser.add_argument("--groups", type=int, default=200)
+    run_parser.add_argument("--group-size", type=int, default=25, help="members of every group but the hot room")
+    run_parser.add_argument("--room-size", type=int, default=200, help="members of the hot room")
+    run_parser.add_argument("--user-groups", type=int, default=50, help="groups of the benchmarked user")
+    run_parser.add_argument("--user-dms", type=int, default=30, help="direct rooms of the benchmarked user")
+    run_parser.add_argument("--messages", type=int, default=20000)
+    run_parser.add_argument("--online", type=int, default=40, help="connected members of the hot room besides the sender")
+    run_parser.add_argument("--page-size", type=int, default=50)
+    run_parser.add_argument("--upload-kb", type=int, default=256)
+    run_parser.add_argument("--iterations", type=int, default=200)
+    run_parser.add_argument("--warmup", type=int, default=20)
+    run_parser.add_argument("--only", nargs="+", help="scenario names to run")
+    run_parser.add_argument("--sql-uri", default="sqlite://", help="SQLAlchemy URI of a throwaway database")
+    run_parser.add_argument("--mongo-uri", help="a mongod to use instead of mongomock")
+    run_parser.add_argument("--mongo-db", default="insync_bench", help="dropped before and after the run")
+    run_parser.add_argument("--output", help="JSON file for the results")
+    run_parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    add_compare_options(run_parser)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    add_compare_options(compare_parser)
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        with open(args.baseline) as baseline , open(args.current) as current:
+            sys.exit(1 if compare(json.load(baseline), json.load(current), args.threshold, args.metric) else 0)
+    sys.exit(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""How many concurrent Socket.IO clients one API worker holds.
+
+Start a single worker ( python serve.py ) , then :
+
+    python benchmarks/sockets.py --url http://127.0.0.1:16000 --clients 2000 --room 1 --users 1,2,3
+
+Clients connect in steps of --step , every client joins the room. A step counts as held when all
+its clients connected within --connect-timeout seconds and the worker still answers : one client
+sends a message to the room and every connected client has to receive it within --broadcast-timeout.
+The run stops at the first step that fails and reports the last one held , with connect ( until
+the join is acknowledged ) and broadcast latencies. Tokens are signed with SECRET_KEY ( from the
+environment or api/.env ) for the given user ids , which must be members of the room.
+
+The clients are eventlet green threads , so the benchmark itself needs eventlet and websocket-client.
+Run it from another machine than the worker , one Python process only drives a few thousand clients.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse , json , os , statistics , sys , time , uuid
+
+from dotenv import load_dotenv
+from flask import Flask
+from flask_jwt_extended import JWTManager , create_access_token
+import socketio
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 2)
+
+
+def make_tokens(secret_key, user_ids):
+    token_app = Flask(__name__)
+    token_app.config["JWT_SECRET_KEY"] = secret_key
+    JWTManager(token_app)
+    with token_app.app_context():
+        return [create_access_token(identity={"user_id": user_id, "username": f"bench{user_id}"}) for user_id in user_ids]
+
+
+class BenchClient:
+    def __init__(self, url, origin, token, room_id):
+        self.url = url
+        self.token = token
+        self.room_id = room_id
+        self.sio = socketio.Client(reconnection=False, websocket_extra_options={"origin": origin})
+        self.received = {}
+        self.joined = eventlet.Event()
+        self.sio.on("receiveMessage", self._on_message)
+        self.sio.on("joined_room", lambda data: self.joined.send(True))
+
+    def _on_message(self, data):
+        self.received[data.get("message")] = time.perf_counter()
+
+    def connect(self, timeout):
+        started = time.perf_counter()
+        self.sio.connect(f"{self.url}?token={self.token}", transports=["websocket"], wait_timeout=timeout)
+        self.sio.emit("joinRoom", {"room_id": self.room_id})
+        # the broadcast only reaches clients whose join was handled
+        with eventlet.Timeout(timeout):
+            self.joined.wait()
+        return time.perf_counter() - started
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def connect_step(pool, clients, timeout):
+    latencies = []
+    failures = 0
+    for result in pool.imap(lambda client: _try_connect(client, timeout), clients):
+        if result is None:
+            failures += 1
+        else:
+            latencies.append(result)
+    return latencies, failures
+
+
+def _try_connect(client, timeout):
+    try:
+        return client.connect(timeout)
+    except (Exception, eventlet.Timeout):
+        return None
+
+
+def broadcast(clients, timeout):
+    """Sends one message from the first client , returns the delay until the last client got it ( None on timeout )."""
+    marker = uuid.uuid4().hex
+    connected = [client for client in clients if client.sio.connected]
+    sent_at = time.perf_counter()
+    connected[0].sio.emit("sendMessage", {"room_id": connected[0].room_id, "message": marker})
+
+    deadline = sent_at + timeout
+    while time.perf_counter() < deadline:
+        arrivals = [client.received.get(marker) for client in connected]
+        if all(arrivals):
+            return [arrival - sent_at for arrival in arrivals]
+        eventlet.sleep(0.05)
+    return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Concurrent Socket.IO clients held by one worker")
+    parser.add_argument("--url", default="http://127.0.0.1:16000")
+    parser.add_argument("--origin", default="http://192.168.100.9:3000", help="must be one of the origins the API accepts")
+    parser.add_argument("--room", type=int, required=True, help="room every client joins")
+    parser.add_argument("--users", required=True, help="comma separated user ids , members of the room")
+    parser.add_argument("--clients", type=int, default=1000, help="maximum number of clients")
+    parser.add_argument("--step", type=int, default=250, help="clients added per step")
+    parser.add_argument("--concurrency", type=int, default=100, help="connections opened at the same time")
+    parser.add_argument("--connect-timeout", type=float, default=10)
+    parser.add_argument("--broadcast-timeout", type=float, default=5)
+    parser.add_argument("--settle", type=float, default=2, help="seconds to wait between a step's joins and its broadcast")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+    secret_key = os.getenv("SECRET_KEY")
+    if not secret_key:
+        sys.exit("SECRET_KEY must be set to sign the client tokens")
+
+    tokens = make_tokens(secret_key, [int(user_id) for user_id in args.users.split(",")])
+    pool = eventlet.GreenPool(args.concurrency)
+    clients = []
+    steps = []
+    held = 0
+    try:
+        while len(clients) < args.clients:
+            new_clients = [
+                BenchClient(args.url, args.origin, tokens[(len(clients) + index) % len(tokens)], args.room)
+                for index in range(min(args.step, args.clients - len(clients)))
+            ]
+            clients.extend(new_clients)
+            latencies, failures = connect_step(pool, new_clients, args.connect_timeout)
+            # every join is announced to the whole room , let those emits drain before measuring
+            eventlet.sleep(args.settle)
+            deliveries = broadcast(clients, args.broadcast_timeout) if latencies else None
+
+            step = {
+                "clients": len(clients),
+                "connect_failures": failures,
+                "connect_p50_ms": percentile(latencies, 0.5),
+                "connect_p99_ms": percentile(latencies, 0.99),
+                "broadcast_p50_ms": percentile(deliveries, 0.5) if deliveries else None,
+                "broadcast_max_ms": round(max(deliveries) * 1000, 2) if deliveries else None,
+            }
+            steps.append(step)
+            print(json.dumps(step))
+            if failures or deliveries is None:
+                break
+            held = len(clients)
+    finally:
+        for client in clients:
+            pool.spawn(client.close)
+        pool.waitall()
+
+    results = {
+        "url": args.url,
+        "held_clients": held,
+        "mean_connect_p50_ms": round(statistics.mean(step["connect_p50_ms"] for step in steps if step["connect_p50_ms"]), 2) if held else None,
+        "steps": steps
+    }
+    print(f"one worker held {held} concurrent clients")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
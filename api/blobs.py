@@ -0,0 +1,98 @@
+from datetime import datetime , timezone
+import glob
+import hashlib
+import os
+import re
+import shutil
+import uuid
+
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def is_sha256(value):
+    return isinstance(value, str) and SHA256_PATTERN.fullmatch(value) is not None
+
+
+class BlobStore:
+    """Content addressed file storage , every file is stored once under its sha256.
+
+    Files live in folder/<first 2 hex digits>/<sha256>. The Blobs collection keeps a reference
+    count per blob , one reference per attachment ( room , name ) pointing at it. Blobs whose count
+    drops to zero are deleted by collect().
+    """
+    def __init__(self, folder, get_collection, buffer_size=1024 * 1024):
+        self.folder = folder
+        self.get_collection = get_collection
+        self.buffer_size = buffer_size
+
+    def path(self, sha256):
+        # the checksum may come from a client , anything else than a hex digest could leave the folder
+        if not is_sha256(sha256):
+            raise ValueError(f"Invalid sha256 {sha256!r}")
+        return os.path.join(self.folder, sha256[:2], sha256)
+
+    def exists(self, sha256):
+        return is_sha256(sha256) and os.path.exists(self.path(sha256))
+
+    def store_stream(self, stream):
+        """Writes a stream to the store while hashing it , returns its sha256 and size.
+        If the same content is already stored the new copy is dropped.
+        """
+        tmp_folder = os.path.join(self.folder, "tmp")
+        os.makedirs(tmp_folder, exist_ok=True)
+        tmp_path = os.path.join(tmp_folder, uuid.uuid4().hex)
+
+        digest = hashlib.sha256()
+        size = 0
+        with open(tmp_path, "wb") as destination:
+            for buffer in iter(lambda: stream.read(self.buffer_size), b""):
+                digest.update(buffer)
+                size += len(buffer)
+                destination.write(buffer)
+
+        sha256 = digest.hexdigest()
+        self.store_file(tmp_path, sha256)
+        return sha256, size
+
+    def store_file(self, path, sha256):
+        """Moves a file whose sha256 is already known into the store."""
+        destination = self.path(sha256)
+        if os.path.exists(destination):
+            os.remove(path)
+            return
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(path, destination)
+
+    def add_ref(self, sha256, size):
+        self.get_collection().update_one(
+            {"sha256": sha256},
+            {"$inc": {"refcount": 1}, "$setOnInsert": {"size": size, "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def release(self, sha256s):
+        """Drops one reference per sha256 given ( a blob may appear several times ) and collects unused blobs."""
+        counts = {}
+        for sha256 in sha256s:
+            counts[sha256] = counts.get(sha256, 0) + 1
+        for sha256, count in counts.items():
+            self.get_collection().update_one({"sha256": sha256}, {"$inc": {"refcount": -count}})
+        return self.collect(list(counts))
+
+    def collect(self, sha256s=None):
+        """Deletes the blobs nobody references anymore , returns how many were deleted."""
+        query = {"refcount": {"$lte": 0}}
+        if sha256s is not None:
+            query["sha256"] = {"$in": sha256s}
+
+        deleted = 0
+        for blob in list(self.get_collection().find(query, {"sha256": 1})):
+            if self.get_collection().delete_one({"_id": blob["_id"], "refcount": {"$lte": 0}}).deleted_count:
+                if not is_sha256(blob["sha256"]):
+                    continue
+                # the blob and the thumbnails cached next to it ( <sha256>.<size>.<ext> )
+                for path in glob.glob(glob.escape(self.path(blob["sha256"])) + "*"):
+                    os.remove(path)
+                deleted += 1
+        return deleted
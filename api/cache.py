@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from threading import Lock
+import json
+import time
+import uuid
+
+
+class RoomEntry:
+    def __init__(self, room_id, room_name, room_type, members):
+        self.room_id = room_id
+        self.room_name = room_name
+        self.room_type = room_type
+        self.members = set(members)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def json(self):
+        return {
+            "room_id": self.room_id,
+            "room_name": self.room_name,
+            "room_type": self.room_type,
+            "members": sorted(self.members)
+        }
+
+
+class RoomCache:
+    """Bounded LRU of room metadata and member sets , keyed by room_id.
+    Routes that change a room or its members must update or invalidate the entry.
+    on_change(room_id) is called after every such change , to forward it to the other workers.
+
+    Loaders run outside the lock , so every change bumps a generation and a loaded entry is only
+    cached when its room did not change ( and the cache was not cleared ) while it was loading.
+    """
+    def __init__(self, max_size=1024, ttl=0, on_change=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_change = on_change
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._generation = 0
+        self._changed_at = {}
+        self._cleared_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, room_id, loader):
+        """Returns the cached entry , or calls loader(room_id) on a miss and caches what it returns.
+        loader returns a RoomEntry or None when the room does not exist ( None is not cached ).
+        """
+        with self._lock:
+            entry = self._entries.get(room_id)
+            if entry is not None and self.ttl and time.monotonic() - entry.loaded_at > self.ttl:
+                del self._entries[room_id]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(room_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            started = self._generation
+
+        entry = loader(room_id)
+        if entry is not None:
+            with self._lock:
+                if self._cleared_at <= started and self._changed_at.get(room_id, 0) <= started:
+                    self._store(entry)
+        return entry
+
+    def put(self, entry):
+        with self._lock:
+            self._bump(entry.room_id)
+            self._store(entry)
+
+    def _store(self, entry):
+        self._entries[entry.room_id] = entry
+        self._entries.move_to_end(entry.room_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _bump(self, room_id):
+        """Called under the lock by everything that changes a room."""
+        self._generation += 1
+        if len(self._changed_at) >= 4 * self.max_size:
+            # forgetting which rooms changed only costs the loads in flight their caching
+            self._changed_at.clear()
+            self._cleared_at = self._generation
+        self._changed_at[room_id] = self._generation
+
+    def add_member(self, room_id, user_id):
+        with self._lock:
+            self._bump(room_id)
+            entry = self._entries.get(room_id)
+            if entry is not None:
+                entry.members = entry.members | {user_id}
+        self._changed(room_id)
+
+    def remove_member(self, room_id, user_id):
+        with self._lock:
+            self._bump(room_id)
+            entry = self._entries.get(room_id)
+            if entry is not None:
+                entry.members = entry.members - {user_id}
+        self._changed(room_id)
+
+    def invalidate(self, room_id, notify=True):
+        """notify=False for invalidations coming from another worker."""
+        with self._lock:
+            self._bump(room_id)
+            self._entries.pop(room_id, None)
+        if notify:
+            self._changed(room_id)
+
+    def _changed(self, room_id):
+        if self.on_change:
+            self.on_change(room_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._changed_at.clear()
+            self._cleared_at = self._generation
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class RedisInvalidationBus:
+    """Forwards room cache changes between workers over Redis pub/sub.
+
+    publish() is the cache's on_change , listen() runs as a background task on every worker and drops
+    the entries other workers changed. The whole cache is cleared whenever the subscription is
+    (re)established , invalidations published while it was down are lost.
+    """
+    def __init__(self, client, channel="insync:room-cache"):
+        import redis
+        self.redis = client
+        self.channel = channel
+        self.worker_id = uuid.uuid4().hex
+        self._errors = (redis.RedisError,)
+        self.published = 0
+        self.received = 0
+        self.failures = 0
+
+    def publish(self, room_id):
+        try:
+            self.redis.publish(self.channel, json.dumps({"worker": self.worker_id, "room_id": room_id}))
+            self.published += 1
+        except self._errors as e:
+            self.failures += 1
+            print(f"room cache: could not publish the invalidation of room {room_id}: {e}")
+
+    def listen(self, cache, sleep):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                cache.clear()
+                for message in pubsub.listen():
+                    change = json.loads(message["data"])
+                    if change["worker"] != self.worker_id:
+                        cache.invalidate(change["room_id"], notify=False)
+                        self.received += 1
+            except self._errors as e:
+                self.failures += 1
+                print(f"room cache: invalidation subscription lost: {e}")
+                sleep(1)
+
+    @property
+    def stats(self):
+        return {
+            "published": self.published,
+            "received": self.received,
+            "failures": self.failures
+        }
+
+
+def create_invalidation_bus(url=None):
+    """Returns a Redis invalidation bus when a url is given , None for a single worker."""
+    if not url:
+        return None
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("A Redis url is set for the room cache but the redis package is not installed")
+    return RedisInvalidationBus(redis.Redis.from_url(url))
@@ -0,0 +1,65 @@
+"""Helpers to run the API on a cooperative server ( eventlet or gevent ).
+
+Under those servers every connected client is a green thread : a blocking call that does not
+go through the patched socket module stalls all of them. monkey_patch() makes the standard
+library , PyMongo and ( with psycogreen ) psycopg2 cooperative. CPU bound work has to leave
+the event loop explicitly , native_offload() returns the function doing that.
+"""
+GREEN_MODES = ("eventlet", "gevent", "gevent_uwsgi")
+
+
+def monkey_patch(async_mode):
+    """Must run before anything else is imported , app.py included."""
+    if async_mode == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    elif async_mode in ("gevent", "gevent_uwsgi"):
+        from gevent import monkey
+        monkey.patch_all()
+    else:
+        raise ValueError(f"Unsupported async mode {async_mode!r} , use one of {', '.join(GREEN_MODES)}")
+
+    # psycopg2 talks to Postgres from C , it only yields to other green threads through psycogreen
+    try:
+        if async_mode == "eventlet":
+            from psycogreen.eventlet import patch_psycopg
+        else:
+            from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        print("psycogreen is not installed , Postgres queries will block the event loop")
+        return
+    patch_psycopg()
+
+
+def run_inline(function, *args):
+    return function(*args)
+
+
+def native_offload(async_mode):
+    """Returns a function running function(*args) on a native thread and waiting for it cooperatively.
+    Outside of a green server it just calls the function.
+    """
+    if async_mode == "eventlet":
+        from eventlet import tpool
+        return tpool.execute
+    if async_mode in ("gevent", "gevent_uwsgi"):
+        from gevent import get_hub
+
+        def offload(function, *args):
+            return get_hub().threadpool.apply(function, args)
+        return offload
+    return run_inline
+
+
+def native_thread_tools(async_mode):
+    """The unpatched Thread class and sleep , for a thread that has to keep running while the
+    green threads are busy ( e.g. a sampling profiler ).
+    """
+    if async_mode == "eventlet":
+        from eventlet import patcher
+        return patcher.original("threading").Thread, patcher.original("time").sleep
+    if async_mode in ("gevent", "gevent_uwsgi"):
+        from gevent import monkey
+        return monkey.get_original("threading", "Thread"), monkey.get_original("time", "sleep")
+    import threading , time
+    return threading.Thread, time.sleep
@@ -0,0 +1,165 @@
+from datetime import datetime , timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING , DESCENDING , TEXT
+from pymongo.errors import OperationFailure
+
+
+class IndexSpec:
+    def __init__(self, keys, **options):
+        self.keys = keys
+        self.options = options
+
+    @property
+    def name(self):
+        return self.options.get("name") or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+    @property
+    def json(self):
+        return {
+            "keys": self.keys,
+            "options": self.options
+        }
+
+
+# Indexes every collection used by app.py needs ( the login audit collections are declared by LoginAuditLog )
+INDEXES = {
+    "UserMessages": [
+        IndexSpec([("room_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]),
+        # Mongo allows a single text index per collection , room filtering happens next to it.
+        # No stemming : chats mix languages
+        IndexSpec([("message", TEXT)], default_language="none"),
+    ],
+    "Notifications": [
+        IndexSpec([("user_id", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexSpec([("user_id", ASCENDING), ("room_id", ASCENDING)], unique=True),
+    ],
+    "Attachments": [
+        IndexSpec([("room_id", ASCENDING), ("name", ASCENDING)], unique=True),
+    ],
+    "Uploads": [
+        IndexSpec([("upload_id", ASCENDING)], unique=True),
+        IndexSpec([("created_at", ASCENDING)]),
+    ],
+    "Blobs": [
+        IndexSpec([("sha256", ASCENDING)], unique=True),
+        IndexSpec([("refcount", ASCENDING)]),
+    ],
+    "JoinedUsers": [
+        IndexSpec([("room_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+        IndexSpec([("user_id", ASCENDING)]),
+    ],
+    "UserSockets": [
+        IndexSpec([("user_id", ASCENDING)]),
+        IndexSpec([("socket_id", ASCENDING)]),
+    ],
+    "OnlineUsers": [
+        IndexSpec([("user_id", ASCENDING)], unique=True),
+    ],
+    "registration": [
+        IndexSpec([("username", ASCENDING)]),
+        IndexSpec([("email", ASCENDING)]),
+    ],
+}
+
+
+class HotQuery:
+    def __init__(self, name, collection, filter, sort=None):
+        self.name = name
+        self.collection = collection
+        self.filter = filter
+        self.sort = sort
+
+    def explain(self, db):
+        cursor = db[self.collection].find(self.filter)
+        if self.sort:
+            cursor = cursor.sort(self.sort)
+        return cursor.limit(20).explain()
+
+
+def _sample_time():
+    return datetime.now(timezone.utc)
+
+
+# The queries app.py runs on every request , with sample values
+HOT_QUERIES = [
+    HotQuery("room messages by page", "UserMessages", {"room_id": 1}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    HotQuery("room messages before cursor", "UserMessages", {"room_id": 1, "$or": [
+        {"timestamp": {"$lt": _sample_time()}},
+        {"timestamp": _sample_time(), "_id": {"$lt": ObjectId()}}
+    ]}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    HotQuery("room messages after cursor", "UserMessages", {"room_id": 1, "$or": [
+        {"timestamp": {"$gt": _sample_time()}},
+        {"timestamp": _sample_time(), "_id": {"$gt": ObjectId()}}
+    ]}, [("timestamp", ASCENDING), ("_id", ASCENDING)]),
+    HotQuery("user notifications", "Notifications", {"user_id": 1}, [("timestamp", DESCENDING)]),
+    HotQuery("notification upsert", "Notifications", {"user_id": 1, "room_id": 1}),
+    HotQuery("message search", "UserMessages", {"$text": {"$search": "hello"}, "room_id": {"$in": [1, 2]}}),
+    HotQuery("attachment lookup", "Attachments", {"room_id": 1, "name": "file.png"}),
+    HotQuery("login failure counters", "LoginCounters", {"key": {"$in": ["username:user", "ip:127.0.0.1"]}, "window": {"$gte": _sample_time()}}),
+]
+
+
+def create_indexes(db, indexes=INDEXES):
+    """Creates the declared indexes , indexes that already exist are left untouched.
+    Returns the names of the indexes per collection.
+    """
+    created = {}
+    for collection, specs in indexes.items():
+        created[collection] = []
+        for spec in specs:
+            try:
+                created[collection].append(db[collection].create_index(spec.keys, **spec.options))
+            except OperationFailure as e:
+                # e.g. a unique index over documents that still hold duplicates , the app keeps working without it
+                print(f"Could not create index {spec.name} on {collection}: {e}")
+    return created
+
+
+def collapse_notifications(db):
+    """Folds the legacy notifications ( one document per message ) into one unread counter per
+    ( user_id , room_id ) , the unique index on that pair can't be built before.
+    Keeps the newest document of every pair , returns how many documents were removed.
+    Lone legacy documents get their count too , $inc on a missing field would start them from 0.
+    """
+    pipeline = [
+        {"$sort": {"timestamp": -1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "room_id": "$room_id"},
+            "keep": {"$first": "$_id"},
+            "documents": {"$sum": 1},
+            "unread_count": {"$sum": {"$ifNull": ["$unread_count", 1]}}
+        }},
+        {"$match": {"documents": {"$gt": 1}}}
+    ]
+    removed = 0
+    for pair in list(db.Notifications.aggregate(pipeline, allowDiskUse=True)):
+        db.Notifications.update_one({"_id": pair["keep"]}, {"$set": {"unread_count": pair["unread_count"]}})
+        removed += db.Notifications.delete_many({
+            "user_id": pair["_id"]["user_id"],
+            "room_id": pair["_id"]["room_id"],
+            "_id": {"$ne": pair["keep"]}
+        }).deleted_count
+    db.Notifications.update_many({"unread_count": {"$exists": False}}, {"$set": {"unread_count": 1}})
+    return removed
+
+
+def find_stages(plan, stage):
+    """Returns True if the explain plan contains the given stage anywhere."""
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage:
+            return True
+        return any(find_stages(value, stage) for value in plan.values())
+    if isinstance(plan, list):
+        return any(find_stages(value, stage) for value in plan)
+    return False
+
+
+def verify_indexes(db, queries=HOT_QUERIES):
+    """Runs explain() on every hot query and returns the names of those doing a collection scan."""
+    collscans = []
+    for query in queries:
+        plan = query.explain(db).get("queryPlanner", {}).get("winningPlan", {})
+        if find_stages(plan, "COLLSCAN"):
+            collscans.append(query.name)
+    return collscans
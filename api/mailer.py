@@ -0,0 +1,146 @@
+from queue import Queue , Empty , Full
+from threading import Thread , Lock
+import smtplib
+import time
+
+
+class MailQueue:
+    """Delivers Flask-Mail messages from a bounded queue with a fixed number of worker threads.
+
+    Every worker keeps its own SMTP connection open between messages , so a burst of mails costs
+    one TLS handshake and login per worker instead of one per mail. A connection idle for
+    idle_timeout seconds is closed. Failed deliveries are retried with exponential backoff
+    on a fresh connection , a message still failing after max_retries is dropped.
+    """
+    def __init__(self, app, mail, workers=2, max_pending=1000, max_retries=4, retry_delay=1.0, idle_timeout=60):
+        self.app = app
+        self.mail = mail
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self._queue = Queue(maxsize=max_pending)
+        self._threads = []
+        self._lock = Lock()
+        self._closing = False
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+        self.connections = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = Thread(target=self._run, name=f"mail-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def submit(self, message):
+        """Queues a message , returns False when the queue is full or closed."""
+        if self._closing:
+            self.rejected += 1
+            return False
+        try:
+            self._queue.put_nowait((message, time.monotonic()))
+        except Full:
+            self.rejected += 1
+            print(f"mail: queue full , dropping mail to {message.recipients}")
+            return False
+        return True
+
+    def close(self, timeout=10):
+        """Delivers what is queued , then stops the workers. Gives up after timeout seconds ,
+        the workers are daemon threads and don't keep the interpreter alive.
+        """
+        self._closing = True
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self._queue.put((None, None), timeout=max(0, deadline - time.monotonic()))
+            except Full:
+                print(f"mail: closing with {self.depth} mails still queued")
+                break
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    @property
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "workers": self.workers,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "connections": self.connections,
+            "avg_latency_ms": round(self.total_latency / self.sent * 1000, 2) if self.sent else 0,
+            "max_latency_ms": round(self.max_latency * 1000, 2)
+        }
+
+    def _connect(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        with self._lock:
+            self.connections += 1
+        return connection
+
+    def _disconnect(self, connection):
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            # the server already dropped it
+            pass
+
+    def _run(self):
+        connection = None
+        with self.app.app_context():
+            while True:
+                try:
+                    message, queued_at = self._queue.get(timeout=self.idle_timeout)
+                except Empty:
+                    if connection is not None:
+                        self._disconnect(connection)
+                        connection = None
+                    continue
+
+                if message is None:
+                    if connection is not None:
+                        self._disconnect(connection)
+                    return
+                connection = self._deliver(connection, message, queued_at)
+
+    def _deliver(self, connection, message, queued_at):
+        """Sends one message , returns the connection to keep using ( None if it is broken )."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.send(message)
+                latency = time.monotonic() - queued_at
+                with self._lock:
+                    self.sent += 1
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                return connection
+            except (smtplib.SMTPException, OSError) as e:
+                if connection is not None:
+                    self._disconnect(connection)
+                    connection = None
+                if isinstance(e, smtplib.SMTPRecipientsRefused) or attempt == self.max_retries:
+                    # retrying a refused address won't help
+                    with self._lock:
+                        self.failed += 1
+                    print(f"mail: could not deliver to {message.recipients}: {e}")
+                    return None
+                with self._lock:
+                    self.retries += 1
+                time.sleep(min(self.retry_delay * 2 ** attempt, 60))
+        return connection
@@ -53,7 +53,7 @@ class UserMessage:
         self.timestamp =  datetime.now(timezone.utc)
         self.message_text = message_text  
         self.message_type = message_type  #"text",  // e.g., text, file
-        self.attachments = attachments   # in  "static/files/rooms/room_id/file.extension" , keep the file.ext
+        self.attachments = attachments   # name , size , content_type and sha256 recorded at upload time
     
     @property
     def json(self):
@@ -69,6 +69,56 @@ class UserMessage:
         return message_dict
     
 
+class Attachment:
+    def __init__(self, room_id, name, size, content_type, sha256, uploaded_by):
+        self.room_id = room_id
+        self.name = name     # file name inside "static/files/rooms/room_id/"
+        self.size = size
+        self.content_type = content_type
+        self.sha256 = sha256
+        self.uploaded_by = uploaded_by
+        self.uploaded_at = datetime.now(timezone.utc)
+        self.missing = False   # set by the integrity sweep when the file is gone from disk
+
+    @property
+    def json(self):
+        return {
+            "room_id": self.room_id,
+            "name": self.name,
+            "size": self.size,
+            "content_type": self.content_type,
+            "sha256": self.sha256,
+            "uploaded_by": self.uploaded_by,
+            "uploaded_at": self.uploaded_at,
+            "missing": self.missing
+        }
+
+
+class Upload:
+    def __init__(self, upload_id, room_id, user_id, name, size, chunk_size, sha256=None):
+        self.upload_id = upload_id
+        self.room_id = room_id
+        self.user_id = user_id
+        self.name = name
+        self.size = size     # declared by the client at init , checked against MAX_SIZE before any data is sent
+        self.chunk_size = chunk_size
+        self.sha256 = sha256   # optional , verified once the file is assembled
+        self.created_at = datetime.now(timezone.utc)
+
+    @property
+    def json(self):
+        return {
+            "upload_id": self.upload_id,
+            "room_id": self.room_id,
+            "user_id": self.user_id,
+            "name": self.name,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "sha256": self.sha256,
+            "created_at": self.created_at
+        }
+
+
 class Notifications:
     def __init__(self,user_id  , room_id, room_name ):
         self.room_id = room_id
@@ -87,6 +137,17 @@ class Notifications:
 
         return notif   
 
+    @property
+    def upsert(self):
+        """Filter and update that fold this notification into the (user_id , room_id) unread counter."""
+        return (
+            {"user_id": self.user_id, "room_id": self.room_id},
+            {
+                "$set": {"room_name": self.room_name, "timestamp": self.timestamp},
+                "$inc": {"unread_count": 1}
+            }
+        )
+
 class OnlineUsers:
     def __init__(self, user_id):
         self.user_id = user_id
@@ -137,6 +198,14 @@ class User(db.Model):
 
     rooms = db.relationship('Room', secondary='RoomUsers', backref=db.backref('users', lazy='dynamic'))
 
+# Prefix search on /user/users , varchar_pattern_ops lets Postgres use them for LIKE 'term%'
+for _column in ("username", "email", "first_name", "last_name"):
+    db.Index(
+        f"ix_users_{_column}_prefix",
+        db.func.lower(getattr(User, _column)).label(_column),
+        postgresql_ops={_column: "varchar_pattern_ops"}
+    )
+
 class Room(db.Model):
     __tablename__ = "Rooms"
     room_id = db.Column(db.Integer, primary_key=True , autoincrement=True)
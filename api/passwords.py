@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor , ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+import multiprocessing
+import time
+
+from werkzeug.security import generate_password_hash , check_password_hash
+
+
+def hash_method(password_hash):
+    """The parameters a hash was made with , e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"."""
+    return password_hash.split("$", 1)[0]
+
+
+class PasswordService:
+    """Hashes and checks passwords on a bounded pool of worker processes.
+
+    Hashing is CPU bound on purpose , running it on the server workers stalls every socket they serve.
+    Callers still wait for the result , but only as long as the hash takes and without holding the GIL.
+    max_workers=0 hashes on the caller's thread ( e.g. for the CLI or a single core machine ).
+    offload replaces the pool when given , e.g. to hash on native threads under eventlet or gevent.
+
+    The workers are forked , and forking a process that runs threads can deadlock the children on a lock
+    one of those threads held ( PyMongo monitors , the write-behind and mail workers ... ). start() forks
+    them all at once and must run before the app starts any thread. A pool broken later is not forked
+    again , hashing falls back to a thread pool ( hashlib releases the GIL while hashing ).
+    """
+    def __init__(self, method, max_workers=2, timeout=30, offload=None):
+        self.method = method
+        self.max_workers = max_workers
+        self.offload = offload
+        self.timeout = timeout
+        self._executor = None
+        self._lock = Lock()
+        self._stats_lock = Lock()
+        self.hashes = 0
+        self.checks = 0
+        self.rehashes = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def start(self):
+        if self.offload or not self.max_workers:
+            return self
+        with self._lock:
+            if self._executor is None:
+                # explicit , the default start method differs between platforms and Python versions
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("fork"))
+        # a fork pool starts all its processes on the first submit
+        self._executor.submit(int).result(self.timeout)
+        return self
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="passwords")
+            return self._executor
+
+    def _run(self, function, *args):
+        started = time.perf_counter()
+        try:
+            if self.offload:
+                return self.offload(function, *args)
+            if not self.max_workers:
+                return function(*args)
+            try:
+                return self._get_executor().submit(function, *args).result(self.timeout)
+            except BrokenProcessPool:
+                # a worker died ( e.g. killed by the OOM killer ) , threads are running by now so no new fork
+                print("passwords: process pool broken , hashing on threads from now on")
+                with self._lock:
+                    self._executor = None
+                return self._get_executor().submit(function, *args).result(self.timeout)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+
+    def hash(self, password):
+        self.hashes += 1
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        self.checks += 1
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return hash_method(password_hash) != self.method
+
+    def verify(self, password_hash, password):
+        """Checks a password against its stored hash.
+        Returns (is_valid , new_hash) , new_hash is set when the stored hash used other parameters than the current ones.
+        """
+        if not self.check(password_hash, password):
+            return False, None
+        if self.needs_rehash(password_hash):
+            self.rehashes += 1
+            return True, self.hash(password)
+        return True, None
+
+    @property
+    def stats(self):
+        operations = self.hashes + self.checks
+        return {
+            "method": self.method,
+            "workers": "offload" if self.offload else self.max_workers,
+            "hashes": self.hashes,
+            "checks": self.checks,
+            "rehashes": self.rehashes,
+            "avg_ms": round(self.total_time / operations * 1000, 2) if operations else 0,
+            "max_ms": round(self.max_time * 1000, 2)
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
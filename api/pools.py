@@ -0,0 +1,149 @@
+from threading import Lock
+import time
+
+from pymongo import monitoring
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """Counters shared by the SQL and the Mongo connection pools.
+
+    checked_out is a gauge , everything else only grows. wait is the time a caller spent
+    getting a connection out of the pool , which includes opening one when the pool had none idle.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = Lock()
+        self.checked_out = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.closed = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def checkout(self, wait):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def checkin(self):
+        with self._lock:
+            self.checked_out -= 1
+
+    def timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def connection_created(self):
+        with self._lock:
+            self.created += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.closed += 1
+
+    @property
+    def stats(self):
+        return {
+            "checked_out": self.checked_out,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "created": self.created,
+            "closed": self.closed,
+            "avg_wait_ms": round(self.wait_time / self.checkouts * 1000, 3) if self.checkouts else 0,
+            "max_wait_ms": round(self.max_wait * 1000, 3)
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """SQLAlchemy's default pool , timing every checkout. Passed to the engine as poolclass."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_stats = PoolStats("sql")
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.pool_stats.timeout()
+            raise
+        self.pool_stats.checkout(time.perf_counter() - started)
+        return record
+
+    def _do_return_conn(self, record):
+        self.pool_stats.checkin()
+        super()._do_return_conn(record)
+
+    def _create_connection(self):
+        record = super()._create_connection()
+        self.pool_stats.connection_created()
+        return record
+
+    def _close_connection(self, connection, *args, **kwargs):
+        self.pool_stats.connection_closed()
+        super()._close_connection(connection, *args, **kwargs)
+
+    def recreate(self):
+        # dispose() builds a new pool , the counters carry over
+        pool = super().recreate()
+        pool.pool_stats = self.pool_stats
+        return pool
+
+
+def sqlalchemy_engine_options(uri, pool_size, max_overflow, pre_ping, recycle, timeout):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database. SQLite keeps its own single connection pool."""
+    options = {"pool_pre_ping": pre_ping}
+    if uri and not uri.startswith("sqlite"):
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=recycle,
+            pool_timeout=timeout
+        )
+    return options
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Feeds PyMongo's connection pool events into a PoolStats , passed to the client as event listener."""
+    def __init__(self, pool_stats=None):
+        self.pool_stats = pool_stats or PoolStats("mongo")
+
+    def connection_checked_out(self, event):
+        self.pool_stats.checkout(getattr(event, "duration", 0) or 0)
+
+    def connection_check_out_failed(self, event):
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self.pool_stats.timeout()
+
+    def connection_checked_in(self, event):
+        self.pool_stats.checkin()
+
+    def connection_created(self, event):
+        self.pool_stats.connection_created()
+
+    def connection_closed(self, event):
+        self.pool_stats.connection_closed()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
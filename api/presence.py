@@ -0,0 +1,244 @@
+import json
+import uuid
+from threading import Lock
+
+
+class PresenceRegistry:
+    """In-process view of who is online and which rooms they have joined.
+
+    user_sids : user_id -> set of socket ids
+    sid_user  : socket id -> user_id
+    room_users: room_id -> set of user_ids that joined the room
+    sid_rooms : socket id -> set of room_ids joined from that socket ( used to clean up on disconnect )
+    """
+    def __init__(self):
+        self.user_sids = {}
+        self.sid_user = {}
+        self.room_users = {}
+        self.sid_rooms = {}
+        self._lock = Lock()
+
+    def connect(self, sid, user_id):
+        with self._lock:
+            self.sid_user[sid] = user_id
+            self.user_sids.setdefault(user_id, set()).add(sid)
+
+    def disconnect(self, sid):
+        with self._lock:
+            user_id = self.sid_user.pop(sid, None)
+            if user_id is None:
+                return None
+            for room_id in self.sid_rooms.pop(sid, set()):
+                self._drop_from_room(room_id, user_id)
+            sids = self.user_sids.get(user_id)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self.user_sids[user_id]
+            return user_id
+
+    def join(self, sid, room_id):
+        with self._lock:
+            user_id = self.sid_user.get(sid)
+            if user_id is None:
+                return
+            self.sid_rooms.setdefault(sid, set()).add(room_id)
+            self.room_users.setdefault(room_id, set()).add(user_id)
+
+    def leave(self, sid, room_id):
+        with self._lock:
+            user_id = self.sid_user.get(sid)
+            if user_id is None:
+                return
+            rooms = self.sid_rooms.get(sid)
+            if rooms is not None:
+                rooms.discard(room_id)
+            self._drop_from_room(room_id, user_id)
+
+    def _drop_from_room(self, room_id, user_id):
+        # a user stays in the room as long as one of their sockets is still joined
+        for sid in self.user_sids.get(user_id, ()):
+            if room_id in self.sid_rooms.get(sid, ()):
+                return
+        users = self.room_users.get(room_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.room_users[room_id]
+
+    def heartbeat(self):
+        """Only the shared registry has other workers to watch."""
+        return 0
+
+    def close(self):
+        pass
+
+    def online_users(self):
+        return set(self.user_sids)
+
+    def online_among(self, user_ids):
+        return self.user_sids.keys() & user_ids
+
+    def joined_users(self, room_id):
+        return set(self.room_users.get(room_id, ()))
+
+    def sids_of(self, user_id):
+        return set(self.user_sids.get(user_id, ()))
+
+    def snapshot(self):
+        """Returns the registry as documents for the OnlineUsers , UserSockets and JoinedUsers collections."""
+        with self._lock:
+            online = [{"user_id": user_id} for user_id in self.user_sids]
+            sockets = [{"user_id": user_id, "socket_id": sid} for sid, user_id in self.sid_user.items()]
+            joined = [
+                {"room_id": room_id, "user_id": user_id}
+                for room_id, users in self.room_users.items()
+                for user_id in users
+            ]
+        return {"OnlineUsers": online, "UserSockets": sockets, "JoinedUsers": joined}
+
+
+class RedisPresenceRegistry:
+    """Presence registry shared by every worker through Redis , same interface as PresenceRegistry.
+    Ids are stored json encoded so integer user/room ids come back as integers.
+
+    Every worker keeps the set of its sids and a heartbeat key expiring after heartbeat_ttl seconds.
+    heartbeat() refreshes it and disconnects the sids of the workers whose heartbeat expired ( crashed or
+    killed ) , otherwise their users would stay online and miss their stored notifications forever.
+    """
+    def __init__(self, client, prefix="insync:presence", heartbeat_ttl=30):
+        self.redis = client
+        self.prefix = prefix
+        self.heartbeat_ttl = heartbeat_ttl
+        self.worker_id = uuid.uuid4().hex
+
+    def _key(self, kind, value):
+        return f"{self.prefix}:{kind}:{json.dumps(value)}"
+
+    def connect(self, sid, user_id):
+        pipe = self.redis.pipeline()
+        pipe.set(self._key("sid", sid), json.dumps(user_id))
+        pipe.sadd(self._key("user", user_id), json.dumps(sid))
+        pipe.sadd(f"{self.prefix}:online", json.dumps(user_id))
+        pipe.sadd(self._key("workersids", self.worker_id), json.dumps(sid))
+        # the first connection may come before the heartbeat task ran
+        pipe.set(self._key("heartbeat", self.worker_id), 1, ex=self.heartbeat_ttl)
+        pipe.sadd(f"{self.prefix}:workers", self.worker_id)
+        pipe.execute()
+
+    def disconnect(self, sid, worker_id=None):
+        raw_user = self.redis.get(self._key("sid", sid))
+        if raw_user is None:
+            return None
+        user_id = json.loads(raw_user)
+        rooms = [json.loads(room) for room in self.redis.smembers(self._key("sidrooms", sid))]
+
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key("sid", sid), self._key("sidrooms", sid))
+        pipe.srem(self._key("user", user_id), json.dumps(sid))
+        pipe.srem(self._key("workersids", worker_id or self.worker_id), json.dumps(sid))
+        pipe.execute()
+
+        for room_id in rooms:
+            self._drop_from_room(room_id, user_id)
+        if not self.redis.scard(self._key("user", user_id)):
+            self.redis.srem(f"{self.prefix}:online", json.dumps(user_id))
+        return user_id
+
+    def join(self, sid, room_id):
+        raw_user = self.redis.get(self._key("sid", sid))
+        if raw_user is None:
+            return
+        pipe = self.redis.pipeline()
+        pipe.sadd(self._key("sidrooms", sid), json.dumps(room_id))
+        pipe.sadd(self._key("room", room_id), raw_user)
+        pipe.execute()
+
+    def leave(self, sid, room_id):
+        raw_user = self.redis.get(self._key("sid", sid))
+        if raw_user is None:
+            return
+        self.redis.srem(self._key("sidrooms", sid), json.dumps(room_id))
+        self._drop_from_room(room_id, json.loads(raw_user))
+
+    def _drop_from_room(self, room_id, user_id):
+        # a user stays in the room as long as one of their sockets is still joined
+        for raw_sid in self.redis.smembers(self._key("user", user_id)):
+            if self.redis.sismember(self._key("sidrooms", json.loads(raw_sid)), json.dumps(room_id)):
+                return
+        self.redis.srem(self._key("room", room_id), json.dumps(user_id))
+
+    def heartbeat(self):
+        """Run every few seconds , well under heartbeat_ttl. Returns how many dead workers were cleaned up."""
+        pipe = self.redis.pipeline()
+        pipe.set(self._key("heartbeat", self.worker_id), 1, ex=self.heartbeat_ttl)
+        pipe.sadd(f"{self.prefix}:workers", self.worker_id)
+        pipe.execute()
+
+        reaped = 0
+        for raw_worker in self.redis.smembers(f"{self.prefix}:workers"):
+            worker_id = raw_worker.decode() if isinstance(raw_worker, bytes) else raw_worker
+            if worker_id == self.worker_id or self.redis.exists(self._key("heartbeat", worker_id)):
+                continue
+            # only one worker cleans up a given dead worker
+            if not self.redis.set(self._key("reaping", worker_id), self.worker_id, nx=True, ex=self.heartbeat_ttl):
+                continue
+            self._remove_worker(worker_id)
+            reaped += 1
+        return reaped
+
+    def close(self):
+        """Drops this worker's sockets , for a clean shutdown."""
+        self._remove_worker(self.worker_id)
+
+    def _remove_worker(self, worker_id):
+        sids = [json.loads(sid) for sid in self.redis.smembers(self._key("workersids", worker_id))]
+        for sid in sids:
+            self.disconnect(sid, worker_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key("workersids", worker_id), self._key("heartbeat", worker_id))
+        pipe.srem(f"{self.prefix}:workers", worker_id)
+        pipe.execute()
+        if sids:
+            print(f"presence: removed {len(sids)} sockets of worker {worker_id}")
+
+    def online_users(self):
+        return {json.loads(user) for user in self.redis.smembers(f"{self.prefix}:online")}
+
+    def online_among(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        flags = self.redis.smismember(f"{self.prefix}:online", [json.dumps(user_id) for user_id in user_ids])
+        return {user_id for user_id, online in zip(user_ids, flags) if online}
+
+    def joined_users(self, room_id):
+        return {json.loads(user) for user in self.redis.smembers(self._key("room", room_id))}
+
+    def sids_of(self, user_id):
+        return {json.loads(sid) for sid in self.redis.smembers(self._key("user", user_id))}
+
+    def snapshot(self):
+        online = [{"user_id": user_id} for user_id in self.online_users()]
+        sockets = []
+        for key in self.redis.scan_iter(match=f"{self.prefix}:sid:*"):
+            raw_user = self.redis.get(key)
+            if raw_user is not None:
+                sid = json.loads(key.decode().split(":sid:", 1)[1])
+                sockets.append({"user_id": json.loads(raw_user), "socket_id": sid})
+        joined = []
+        for key in self.redis.scan_iter(match=f"{self.prefix}:room:*"):
+            room_id = json.loads(key.decode().split(":room:", 1)[1])
+            joined.extend({"room_id": room_id, "user_id": json.loads(user)} for user in self.redis.smembers(key))
+        return {"OnlineUsers": online, "UserSockets": sockets, "JoinedUsers": joined}
+
+
+def create_presence_registry(url=None, heartbeat_ttl=30):
+    """Returns a Redis backed registry when a url is given , the in-process one otherwise."""
+    if not url:
+        return PresenceRegistry()
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("PRESENCE_REDIS_URL is set but the redis package is not installed")
+    return RedisPresenceRegistry(redis.Redis.from_url(url), heartbeat_ttl=heartbeat_ttl)
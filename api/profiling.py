@@ -0,0 +1,179 @@
+from collections import Counter
+from datetime import datetime , timezone
+from threading import Lock
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import re
+import sys
+import time
+
+
+def endpoint_filename(endpoint):
+    """/room/messages/<int:room_id> -> room_messages_int_room_id"""
+    return re.sub(r"[^A-Za-z0-9]+", "_", endpoint).strip("_") or "root"
+
+
+class RequestProfiler:
+    """Runs cProfile around a fraction of the requests and socket events.
+
+    The profiles of every endpoint are merged in memory and written to folder/<endpoint>.pstats by
+    dump() ( on the /admin/profiling routes and at exit ) , open them with python -m pstats or snakeviz.
+    Under eventlet or gevent the green threads share one OS thread , a profile can then include
+    frames of other clients that ran while the profiled one waited on I/O.
+    """
+    def __init__(self, folder, sample_rate=0.0):
+        self.folder = folder
+        self.sample_rate = sample_rate
+        self._stats = {}
+        self._unsaved = set()
+        self._lock = Lock()
+        self.profiled = 0
+        self.skipped = 0
+
+    def should_profile(self, forced=False):
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def start(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active on this thread
+            self.skipped += 1
+            return None
+        return profile
+
+    def finish(self, profile, endpoint):
+        profile.disable()
+        profile_stats = pstats.Stats(profile)
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                self._stats[endpoint] = profile_stats
+            else:
+                stats.add(profile_stats)
+            self._unsaved.add(endpoint)
+            self.profiled += 1
+
+    def dump(self):
+        """Writes the endpoints profiled since the last dump , returns how many files were written."""
+        with self._lock:
+            # serialised under the lock , written without it
+            dumps = {endpoint: marshal.dumps(self._stats[endpoint].stats) for endpoint in self._unsaved}
+            self._unsaved.clear()
+        if dumps:
+            os.makedirs(self.folder, exist_ok=True)
+        for endpoint, data in dumps.items():
+            with open(os.path.join(self.folder, f"{endpoint_filename(endpoint)}.pstats"), "wb") as output:
+                output.write(data)
+        return len(dumps)
+
+    @property
+    def stats(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "profiled": self.profiled,
+            "skipped": self.skipped,
+            "unsaved": len(self._unsaved),
+            "endpoints": sorted(self._stats)
+        }
+
+
+class StackSampler:
+    """Time boxed sampling profiler for the whole worker.
+
+    A native thread snapshots the stack of every other thread each interval seconds , attributes the
+    sample to the route or socket event found on the stack ( get_endpoints returns {code object: name} )
+    and writes collapsed stacks per endpoint when the capture ends , the input of flamegraph.pl or speedscope.
+    on_finish runs on the sampler thread once the files are written.
+    """
+    def __init__(self, folder, get_endpoints, thread_class, sleep, interval=0.005, max_duration=300, on_finish=None):
+        self.folder = folder
+        self.on_finish = on_finish
+        self.get_endpoints = get_endpoints
+        self.thread_class = thread_class
+        self.sleep = sleep
+        self.interval = interval
+        self.max_duration = max_duration
+        self._lock = Lock()
+        self._thread = None
+        self._stopping = False
+        self.samples = Counter()
+        self.started_at = None
+        self.ends_at = None
+        self.last_capture = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration):
+        with self._lock:
+            if self.running:
+                return False
+            duration = min(duration, self.max_duration)
+            self.samples = Counter()
+            self._stopping = False
+            self.started_at = datetime.now(timezone.utc)
+            self.ends_at = time.monotonic() + duration
+            self._thread = self.thread_class(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Ends the capture early , returns the folder the stacks were written to."""
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+        return self.last_capture
+
+    def _run(self):
+        endpoints = self.get_endpoints()
+        own_ident = self._thread.ident
+        while not self._stopping and time.monotonic() < self.ends_at:
+            for ident, frame in sys._current_frames().items():
+                if ident != own_ident:
+                    self._sample(frame, endpoints)
+            self.sleep(self.interval)
+        self.last_capture = self._write()
+        if self.on_finish:
+            self.on_finish()
+
+    def _sample(self, frame, endpoints):
+        stack = []
+        endpoint = "other"
+        while frame is not None:
+            code = frame.f_code
+            if code in endpoints:
+                endpoint = endpoints[code]
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.reverse()
+        self.samples[(endpoint, ";".join(stack))] += 1
+
+    def _write(self):
+        folder = os.path.join(self.folder, self.started_at.strftime("capture-%Y%m%dT%H%M%S"))
+        os.makedirs(folder, exist_ok=True)
+        per_endpoint = {}
+        for (endpoint, stack), count in self.samples.items():
+            per_endpoint.setdefault(endpoint, []).append(f"{stack} {count}")
+        with open(os.path.join(folder, "all.collapsed"), "w") as combined:
+            for endpoint, lines in sorted(per_endpoint.items()):
+                with open(os.path.join(folder, f"{endpoint_filename(endpoint)}.collapsed"), "w") as output:
+                    output.write("\n".join(lines) + "\n")
+                # the endpoint as root frame , one flame per endpoint
+                combined.writelines(f"{endpoint};{line}\n" for line in lines)
+        return folder
+
+    @property
+    def stats(self):
+        return {
+            "running": self.running,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "remaining": round(max(0, self.ends_at - time.monotonic()), 1) if self.running else 0,
+            "samples": sum(self.samples.values()),
+            "last_capture": self.last_capture
+        }
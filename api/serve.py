@@ -0,0 +1,43 @@
+"""Production entry point : serves the API on eventlet or gevent instead of the development server.
+
+Every Socket.IO client and every HTTP request is a green thread , so one worker holds thousands of
+idle sockets and a slow Mongo or Postgres call only blocks the client waiting for it.
+The async mode comes from INSYNC_ASYNC_MODE ( eventlet by default , or gevent ) and the standard
+library is monkey patched before app.py is imported. Install psycogreen so psycopg2 cooperates too.
+
+usage : python serve.py
+        INSYNC_ASYNC_MODE=gevent python serve.py
+        gunicorn --worker-class eventlet -w 1 --bind 0.0.0.0:16000 serve:app
+
+Run one process per core with workers.py ( or one gunicorn per port ) behind a sticky proxy ,
+a Socket.IO server can't share its clients between gunicorn workers of the same port.
+Missing Mongo indexes are created when this module is imported ( MONGO_CREATE_INDEXES=0 skips it ,
+then run "flask --app app create-indexes" on every deploy ).
+"""
+import os
+
+from concurrency import monkey_patch
+
+async_mode = os.environ.setdefault("INSYNC_ASYNC_MODE", "eventlet")
+monkey_patch(async_mode)
+
+from app import app , socketio , create_mongo_indexes
+
+# at import rather than in main() , so "gunicorn serve:app" creates them too
+if app.config["MONGO_CREATE_INDEXES"]:
+    create_mongo_indexes()
+
+
+def main():
+    socketio.run(
+        app,
+        host=os.getenv("INSYNC_HOST", "0.0.0.0"),
+        port=int(os.getenv("INSYNC_PORT", 16000)),
+        debug=False,
+        use_reloader=False,
+        log_output=os.getenv("INSYNC_ACCESS_LOG", "0") == "1"
+    )
+
+
+if __name__ == "__main__":
+    main()
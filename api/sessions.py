@@ -0,0 +1,57 @@
+from datetime import datetime , timezone
+from threading import Lock
+
+
+class SocketSession:
+    def __init__(self, sid, user_id, username, expires_at):
+        self.sid = sid
+        self.user_id = user_id
+        self.username = username
+        self.expires_at = expires_at   # unix timestamp taken from the JWT "exp" claim
+        self.connected_at = datetime.now(timezone.utc)
+
+    @property
+    def expired(self):
+        return datetime.now(timezone.utc).timestamp() >= self.expires_at
+
+    @property
+    def json(self):
+        return {
+            "sid": self.sid,
+            "user_id": self.user_id,
+            "username": self.username,
+            "expires_at": self.expires_at,
+            "connected_at": self.connected_at.isoformat()
+        }
+
+
+class SessionStore:
+    """Keeps the authenticated identity of every connected socket, keyed by sid.
+    The token is verified once on connect , every later event reads from here.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = Lock()
+
+    def open(self, sid, payload):
+        identity = payload["sub"]
+        session = SocketSession(sid, identity["user_id"], identity.get("username"), payload["exp"])
+        with self._lock:
+            self._sessions[sid] = session
+        return session
+
+    def get(self, sid):
+        return self._sessions.get(sid)
+
+    def close(self, sid):
+        with self._lock:
+            return self._sessions.pop(sid, None)
+
+    def expired(self):
+        """Returns the sessions whose token has expired."""
+        now = datetime.now(timezone.utc).timestamp()
+        with self._lock:
+            return [session for session in self._sessions.values() if now >= session.expires_at]
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,70 @@
+"""Recording an attachment while another upload takes the same name."""
+import io
+
+import pytest
+
+from indexes import INDEXES , create_indexes
+
+
+@pytest.fixture
+def attachments(api, db):
+    create_indexes(api.mongo.db, {"Attachments": INDEXES["Attachments"], "Blobs": INDEXES["Blobs"]})
+    return api.mongo.db.Attachments
+
+
+def store(api, content):
+    return api.blob_store.store_stream(io.BytesIO(content))
+
+
+def racing_insert(api, monkeypatch, attachments, concurrent):
+    """The first insert loses against an upload of concurrent under the same name."""
+    insert_one = attachments.insert_one
+
+    def insert(document):
+        monkeypatch.setattr(attachments, "insert_one", insert_one)
+        checksum, size = store(api, concurrent)
+        api.blob_store.add_ref(checksum, size)
+        insert_one(dict(document, sha256=checksum, size=size))
+        return insert_one(document)
+    monkeypatch.setattr(attachments, "insert_one", insert)
+
+
+def refcount(api, checksum):
+    blob = api.mongo.db.Blobs.find_one({"sha256": checksum})
+    return blob["refcount"] if blob else 0
+
+
+def test_different_content_racing_for_a_name_gets_its_own_name(api, attachments, monkeypatch):
+    checksum, size = store(api, b"ours")
+    racing_insert(api, monkeypatch, attachments, b"theirs")
+
+    attachment = api.record_attachment(1, "report.txt", size, "text/plain", checksum, 1)
+
+    assert attachment["name"] == f"report-{checksum[:8]}.txt"
+    assert attachment["sha256"] == checksum
+    assert attachments.find_one({"name": "report.txt"})["sha256"] != checksum
+    assert refcount(api, checksum) == 1
+    assert api.blob_store.exists(checksum)
+
+
+def test_same_content_racing_for_a_name_shares_the_mapping(api, attachments, monkeypatch):
+    checksum, size = store(api, b"same")
+    racing_insert(api, monkeypatch, attachments, b"same")
+
+    attachment = api.record_attachment(1, "report.txt", size, "text/plain", checksum, 1)
+
+    assert attachment["name"] == "report.txt"
+    assert attachments.count_documents({}) == 1
+    # one reference for the one mapping , and the blob stays on disk
+    assert refcount(api, checksum) == 1
+    assert api.blob_store.exists(checksum)
+
+
+def test_reusing_a_mapping_does_not_add_a_reference(api, attachments):
+    checksum, size = store(api, b"again")
+
+    first = api.record_attachment(1, "a.txt", size, "text/plain", checksum, 1)
+    second = api.record_attachment(1, "a.txt", size, "text/plain", checksum, 2)
+
+    assert second["_id"] == first["_id"]
+    assert refcount(api, checksum) == 1
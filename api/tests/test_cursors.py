@@ -0,0 +1,28 @@
+"""Pagination cursors of /room/messages and message search."""
+import datetime
+
+import pytest
+from bson import ObjectId
+
+
+def test_cursors_round_trip(api):
+    message_id = ObjectId()
+    timestamp = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+
+    cursor = api.encode_cursor({"_id": message_id, "timestamp": timestamp}, "timestamp")
+    assert api.decode_cursor(cursor, "timestamp") == (timestamp, message_id)
+
+    cursor = api.encode_cursor({"_id": message_id, "score": 1.5}, "score")
+    assert api.decode_cursor(cursor, "score") == (1.5, message_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64 !", "e30=", "eyJ0IjogMX0="])
+def test_malformed_cursors_are_rejected(api, cursor):
+    with pytest.raises(ValueError):
+        api.decode_cursor(cursor, "timestamp")
+
+
+def test_cursor_of_another_kind_is_rejected(api):
+    cursor = api.encode_cursor({"_id": ObjectId(), "score": 2.0}, "score")
+    with pytest.raises(ValueError):
+        api.decode_cursor(cursor, "timestamp")
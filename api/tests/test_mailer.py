@@ -0,0 +1,136 @@
+"""MailQueue against a local aiosmtpd server."""
+import socket , threading , time
+
+import pytest
+from aiosmtpd.controller import Controller
+from flask import Flask
+from flask_mail import Mail , Message
+
+from mailer import MailQueue
+
+
+class Recorder:
+    """SMTP handler keeping the delivered messages and the connection each came from.
+    fail_first answers that many DATA commands with a temporary error , gate blocks deliveries until set.
+    """
+    def __init__(self, fail_first=0, gate=None):
+        self.fail_first = fail_first
+        self.gate = gate
+        self.messages = []
+        self.peers = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.gate is not None:
+            while not self.gate.is_set():
+                time.sleep(0.01)
+        if self.fail_first:
+            self.fail_first -= 1
+            return "451 Try again later"
+        self.messages.append(envelope.rcpt_tos)
+        self.peers.append(session.peer)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    servers = []
+
+    def start(handler):
+        controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        servers.append(controller)
+        return controller
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+def mail_queue(controller, **options):
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER=controller.hostname,
+        MAIL_PORT=controller.port,
+        MAIL_USE_SSL=False,
+        MAIL_USE_TLS=False,
+        MAIL_USERNAME=None,
+        MAIL_PASSWORD=None,
+        MAIL_DEFAULT_SENDER="noreply@test.local"
+    )
+    options.setdefault("retry_delay", 0.01)
+    return MailQueue(app, Mail(app), **options).start()
+
+
+def message(index):
+    return Message(f"Reset {index}", sender="noreply@test.local", recipients=[f"user{index}@test.local"], body="reset link")
+
+
+def test_delivers_every_message(smtp):
+    recorder = Recorder()
+    queue = mail_queue(smtp(recorder), workers=2)
+
+    for index in range(6):
+        assert queue.submit(message(index))
+    queue.close()
+
+    assert sorted(recipients[0] for recipients in recorder.messages) == sorted(f"user{index}@test.local" for index in range(6))
+    assert queue.stats["sent"] == 6
+    assert queue.stats["failed"] == 0
+
+
+def test_worker_reuses_its_connection(smtp):
+    recorder = Recorder()
+    queue = mail_queue(smtp(recorder), workers=1)
+
+    for index in range(5):
+        queue.submit(message(index))
+    queue.close()
+
+    assert len(recorder.messages) == 5
+    assert len(set(recorder.peers)) == 1
+    assert queue.stats["connections"] == 1
+
+
+def test_retries_temporary_failures(smtp):
+    recorder = Recorder(fail_first=2)
+    queue = mail_queue(smtp(recorder), workers=1, max_retries=3)
+
+    queue.submit(message(1))
+    queue.close()
+
+    assert recorder.messages == [["user1@test.local"]]
+    assert queue.stats["retries"] == 2
+    assert queue.stats["sent"] == 1
+    # a failed delivery is retried on a fresh connection
+    assert queue.stats["connections"] == 3
+
+
+def test_gives_up_after_max_retries(smtp):
+    recorder = Recorder(fail_first=10)
+    queue = mail_queue(smtp(recorder), workers=1, max_retries=1)
+
+    queue.submit(message(1))
+    queue.close()
+
+    assert recorder.messages == []
+    assert queue.stats["failed"] == 1
+
+
+def test_close_does_not_block_on_a_full_queue(smtp):
+    gate = threading.Event()
+    queue = mail_queue(smtp(Recorder(gate=gate)), workers=1, max_pending=1)
+
+    queue.submit(message(1))
+    time.sleep(0.2)  # the worker is now stuck delivering the first message
+    assert queue.submit(message(2))
+    assert not queue.submit(message(3))
+
+    started = time.monotonic()
+    queue.close(timeout=0.5)
+    assert time.monotonic() - started < 2
+    gate.set()
@@ -0,0 +1,34 @@
+"""Migration of the one-per-message notifications into unread counters."""
+from datetime import datetime , timedelta , timezone
+
+import mongomock
+
+from indexes import INDEXES , collapse_notifications , create_indexes
+
+
+def test_collapse_notifications_keeps_one_counter_per_room():
+    db = mongomock.MongoClient().insync_tests
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    db.Notifications.insert_many(
+        [{"user_id": 1, "room_id": 5, "room_name": "old name", "timestamp": started + timedelta(minutes=index)} for index in range(3)]
+        + [{"user_id": 1, "room_id": 5, "room_name": "new name", "timestamp": started + timedelta(hours=1), "unread_count": 4}]
+        + [{"user_id": 2, "room_id": 5, "room_name": "new name", "timestamp": started, "unread_count": 2}]
+        + [{"user_id": 3, "room_id": 5, "room_name": "new name", "timestamp": started}]
+    )
+
+    assert collapse_notifications(db) == 3
+    assert collapse_notifications(db) == 0
+
+    counters = {(notification["user_id"], notification["room_id"]): notification for notification in db.Notifications.find()}
+    assert set(counters) == {(1, 5), (2, 5), (3, 5)}
+    assert counters[(1, 5)]["unread_count"] == 7
+    assert counters[(1, 5)]["room_name"] == "new name"
+    assert counters[(2, 5)]["unread_count"] == 2
+    # a lone legacy notification counts as one unread message
+    assert counters[(3, 5)]["unread_count"] == 1
+
+    db.Notifications.update_one({"user_id": 3, "room_id": 5}, {"$inc": {"unread_count": 1}}, upsert=True)
+    assert db.Notifications.find_one({"user_id": 3})["unread_count"] == 2
+
+    create_indexes(db, {"Notifications": INDEXES["Notifications"]})
+    assert "user_id_1_room_id_1" in db.Notifications.index_information()
@@ -0,0 +1,104 @@
+"""Presence registries , the in-process one and the Redis one.
+
+The Redis registry runs against fakeredis , or against a real server when PRESENCE_TEST_REDIS_URL is set
+( its keys go under a prefix of their own ).
+"""
+import os , uuid
+
+import pytest
+
+from presence import PresenceRegistry , RedisPresenceRegistry
+
+
+def redis_client():
+    url = os.getenv("PRESENCE_TEST_REDIS_URL")
+    if url:
+        import redis
+        return redis.Redis.from_url(url)
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def redis_prefix():
+    client = redis_client()
+    prefix = f"insync-tests:{uuid.uuid4().hex}"
+    yield client , prefix
+    for key in client.scan_iter(match=f"{prefix}:*"):
+        client.delete(key)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def registry(request):
+    if request.param == "memory":
+        return PresenceRegistry()
+    client , prefix = request.getfixturevalue("redis_prefix")
+    return RedisPresenceRegistry(client, prefix)
+
+
+def test_user_with_several_sockets(registry):
+    registry.connect("a", 1)
+    registry.connect("b", 1)
+    registry.join("a", 10)
+    registry.join("b", 10)
+    registry.join("b", 11)
+    assert registry.sids_of(1) == {"a", "b"}
+    assert registry.joined_users(10) == {1}
+
+    # still in room 10 through socket b
+    registry.leave("a", 10)
+    assert registry.joined_users(10) == {1}
+
+    assert registry.disconnect("b") == 1
+    assert registry.joined_users(10) == set()
+    assert registry.joined_users(11) == set()
+    assert registry.online_users() == {1}
+    assert registry.sids_of(1) == {"a"}
+
+    assert registry.disconnect("a") == 1
+    assert registry.online_users() == set()
+    assert registry.disconnect("a") is None
+
+
+def test_online_among_and_sids_of(registry):
+    registry.connect("a", 1)
+    registry.connect("b", 2)
+    registry.connect("c", 2)
+
+    assert registry.online_among([1, 2, 3]) == {1, 2}
+    assert registry.online_among([]) == set()
+    assert registry.sids_of(2) == {"b", "c"}
+    assert registry.sids_of(3) == set()
+
+    registry.disconnect("a")
+    assert registry.online_among([1, 2, 3]) == {2}
+
+
+def test_sockets_of_a_dead_worker_are_reaped(redis_prefix):
+    client , prefix = redis_prefix
+    alive = RedisPresenceRegistry(client, prefix)
+    dead = RedisPresenceRegistry(client, prefix)
+    alive.connect("a", 1)
+    dead.connect("b", 2)
+    dead.join("b", 10)
+
+    # the dead worker is not reaped while its heartbeat is fresh
+    assert alive.heartbeat() == 0
+    assert alive.online_users() == {1, 2}
+
+    client.delete(dead._key("heartbeat", dead.worker_id))
+    assert alive.heartbeat() == 1
+    assert alive.online_users() == {1}
+    assert alive.sids_of(2) == set()
+    assert alive.joined_users(10) == set()
+    assert alive.heartbeat() == 0
+
+
+def test_close_removes_the_workers_sockets(redis_prefix):
+    client , prefix = redis_prefix
+    registry = RedisPresenceRegistry(client, prefix)
+    registry.connect("a", 1)
+
+    registry.close()
+    assert registry.online_users() == set()
+    assert registry.snapshot() == {"OnlineUsers": [], "UserSockets": [], "JoinedUsers": []}
@@ -0,0 +1,73 @@
+"""/user/groups and /user/dms load rooms and members in a constant number of queries."""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+@contextmanager
+def count_queries(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def seed(models, groups, dms, members_per_group=3):
+    """User 1 belongs to `groups` group rooms and `dms` direct rooms."""
+    users = [
+        models.User(username=f"user{user_id}", password="x", email=f"user{user_id}@test.local", first_name="First",
+                    last_name="Last", account_status="active", role="student")
+        for user_id in range(1, members_per_group + dms + 2)
+    ]
+    models.db.session.add_all(users)
+    models.db.session.flush()
+
+    for index in range(groups):
+        room = models.Room(room_type="group", room_name=f"group {index}")
+        models.db.session.add(room)
+        models.db.session.flush()
+        for user in users[:members_per_group]:
+            models.db.session.add(models.RoomUsers(user_id=user.user_id, room_id=room.room_id))
+    for recipient in users[1:dms + 1]:
+        room = models.Room(room_type="direct")
+        models.db.session.add(room)
+        models.db.session.flush()
+        models.db.session.add_all([
+            models.RoomUsers(user_id=1, room_id=room.room_id),
+            models.RoomUsers(user_id=recipient.user_id, room_id=room.room_id)
+        ])
+    models.db.session.commit()
+
+
+def test_user_groups_query_count(api, db, client_for):
+    seed(api.models, groups=8, dms=0)
+    client = client_for(1)
+
+    with count_queries(db.engine) as statements:
+        response = client.get("/user/groups")
+
+    assert response.status_code == 200
+    group_rooms = response.get_json()["group_rooms"]
+    assert len(group_rooms) == 8
+    assert all(len(room["users"]) == 3 for room in group_rooms)
+    assert len(statements) == 2, statements
+
+
+def test_user_dms_query_count(api, db, client_for):
+    seed(api.models, groups=0, dms=6)
+    client = client_for(1)
+
+    with count_queries(db.engine) as statements:
+        response = client.get("/user/dms")
+
+    assert response.status_code == 200
+    direct_rooms = response.get_json()["direct_rooms"]
+    assert len(direct_rooms) == 6
+    assert all(len(room["users"]) == 1 and room["users"][0]["user_id"] != 1 for room in direct_rooms)
+    assert len(statements) == 2, statements
@@ -0,0 +1,61 @@
+"""Room cache entries loaded while their room changes must not be cached."""
+from cache import RoomCache , RoomEntry
+
+
+def loader_that(change):
+    """Returns a loader reading the room , then running change() before returning what it read."""
+    calls = []
+
+    def load(room_id):
+        calls.append(room_id)
+        entry = RoomEntry(room_id, "room", "group", {1, 2})
+        if len(calls) == 1:
+            change()
+        return entry
+    return load , calls
+
+
+def test_member_added_while_loading_is_not_lost():
+    cache = RoomCache()
+    load , calls = loader_that(lambda: cache.add_member(7, 3))
+
+    assert cache.get(7, load).members == {1, 2}
+    # the stale member set was not cached , the next lookup loads the room again
+    cache.get(7, load)
+    assert len(calls) == 2
+    assert cache.get(7, load).members == {1, 2}
+    assert len(calls) == 2
+
+
+def test_room_invalidated_while_loading_is_not_cached():
+    cache = RoomCache()
+    load , calls = loader_that(lambda: cache.invalidate(7))
+
+    cache.get(7, load)
+    cache.get(7, load)
+    assert len(calls) == 2
+
+
+def test_clear_while_loading_is_not_undone():
+    cache = RoomCache()
+    load , calls = loader_that(cache.clear)
+
+    cache.get(7, load)
+    assert cache.stats["size"] == 0
+
+
+def test_changes_to_other_rooms_do_not_prevent_caching():
+    cache = RoomCache()
+    load , calls = loader_that(lambda: cache.remove_member(8, 1))
+
+    cache.get(7, load)
+    cache.get(7, load)
+    assert len(calls) == 1
+    assert cache.stats["hits"] == 1
+
+
+def test_change_history_stays_bounded():
+    cache = RoomCache(max_size=2)
+    for room_id in range(100):
+        cache.invalidate(room_id)
+    assert len(cache._changed_at) <= 8
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are optional , originals are served instead
+    Image = None
+
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+
+def is_image(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def variant_extension(filename):
+    """Thumbnails of jpegs stay jpegs , everything else becomes a png ( first frame for gifs )."""
+    return 'jpg' if filename.rsplit('.', 1)[-1].lower() in ('jpg', 'jpeg') else 'png'
+
+
+def variant_path(path, size, filename):
+    """Thumbnails are cached next to the original : <original>.<size>.<jpg|png>"""
+    return f"{path}.{size}.{variant_extension(filename)}"
+
+
+class ThumbnailPipeline:
+    """Generates fixed size thumbnails of uploaded images on a bounded pool of worker threads.
+
+    Nothing waits for the result : until a variant exists the routes serving files fall back to the original.
+    Each worker runs the resizing through offload , which moves it to a native thread under a green server.
+    """
+    def __init__(self, sizes, max_workers=2, offload=None):
+        self.sizes = tuple(sorted(sizes))
+        self.offload = offload
+        self.enabled = Image is not None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails") if self.enabled else None
+        self.submitted = 0
+        self.generated = 0
+        self.failures = 0
+
+    def submit(self, path, filename):
+        """Queues the thumbnails of the image stored at path. filename is its user facing name."""
+        if not self.enabled or not is_image(filename):
+            return None
+        self.submitted += 1
+        if self.offload:
+            return self._executor.submit(self.offload, self.generate, path, filename)
+        return self._executor.submit(self.generate, path, filename)
+
+    def generate(self, path, filename):
+        try:
+            with Image.open(path) as image:
+                image.load()
+                if variant_extension(filename) == 'jpg':
+                    image = image.convert('RGB')
+                elif image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+
+                for size in self.sizes:
+                    destination = variant_path(path, size, filename)
+                    if os.path.exists(destination):
+                        continue
+                    thumbnail = image.copy()
+                    # never upscale , a small original is its own thumbnail
+                    thumbnail.thumbnail((size, size))
+                    partial_path = destination + '.part'
+                    thumbnail.save(partial_path, format='JPEG' if variant_extension(filename) == 'jpg' else 'PNG')
+                    os.replace(partial_path, destination)
+                    self.generated += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"thumbnails: could not process {filename}: {e}")
+
+    @property
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "submitted": self.submitted,
+            "generated": self.generated,
+            "failures": self.failures
+        }
+
+    def remove(self, path, filename):
+        """Deletes the cached thumbnails of an original."""
+        for size in self.sizes:
+            try:
+                os.remove(variant_path(path, size, filename))
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,264 @@
+from collections import Counter
+from datetime import datetime , timezone
+from queue import Queue , Full
+from threading import Lock , Thread , local
+import json
+import os
+import sys
+import time
+
+from pymongo import monitoring
+
+
+# keys PyMongo adds to every command , they say nothing about the query
+MONGO_DRIVER_KEYS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction", "apiVersion"}
+MONGO_EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+
+
+def query_shape(value):
+    """The structure of a Mongo command with every value replaced by "?" , identical for N+1 lookups."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items() if key not in MONGO_DRIVER_KEYS}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(value[0]), f"x{len(value)}"] if value else []
+    return "?"
+
+
+def mongo_plan_summary(plan):
+    """FETCH > IXSCAN room_id_1_timestamp_-1 , from the winning plan of an explain()."""
+    stages = []
+    while isinstance(plan, dict) and plan:
+        stage = plan.get("stage") or plan.get("queryPlan", {}).get("stage")
+        if stage:
+            stages.append(f"{stage} {plan['indexName']}" if plan.get("indexName") else stage)
+        plan = plan.get("inputStage") or plan.get("queryPlan") or (plan.get("inputStages") or [None])[0]
+    return " > ".join(stages) or None
+
+
+class QueryTrace:
+    """Database calls of one route or socket event , counted per statement shape."""
+    def __init__(self, handler):
+        self.handler = handler
+        self.counts = Counter()
+
+
+class QueryTracer:
+    """Logs slow Mongo commands and SQL statements , and repeated identical queries of one handler , as JSON lines.
+
+    get_trace returns the QueryTrace of the route or socket event being handled ( None outside of one ).
+    A call slower than threshold_ms is logged with its statement ( values left out ) , duration and ,
+    when explain is on , a summary of its plan ( computed once per statement shape every plan_ttl seconds ).
+    Plans are computed on a background thread with a connection of its own , so a slow request doesn't
+    wait for an explain ( nor for a second pooled connection ) , the record is written once the plan is known.
+    A statement shape issued repeat_threshold times or more by one handler is logged when the handler ends ,
+    that's the N+1 pattern.
+    """
+    def __init__(self, get_trace, threshold_ms=100, repeat_threshold=5, log_path=None, explain=True, get_db=None, plan_ttl=600,
+                 max_pending_explains=100):
+        self.get_trace = get_trace
+        self.threshold_ms = threshold_ms
+        self.repeat_threshold = repeat_threshold
+        self.log_path = log_path
+        self.explain = explain
+        self.get_db = get_db
+        self.plan_ttl = plan_ttl
+        self._pending = {}
+        self._plans = {}
+        self._lock = Lock()
+        self._local = local()
+        self._explains = Queue(maxsize=max_pending_explains)
+        self._explain_thread = None
+        self.slow_queries = 0
+        self.repeated_queries = 0
+        self.explains_skipped = 0
+
+    # -- handlers
+
+    def begin(self, handler):
+        return QueryTrace(handler)
+
+    def end(self, trace):
+        if trace is None or not self.repeat_threshold:
+            return
+        for (store, statement), count in trace.counts.items():
+            if count >= self.repeat_threshold:
+                self.repeated_queries += 1
+                self.write({"type": "repeated_query", "store": store, "handler": trace.handler, "count": count, "statement": statement})
+
+    # -- output
+
+    def write(self, record):
+        record = {"time": datetime.now(timezone.utc).isoformat(), "pid": os.getpid(), **record}
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self.log_path:
+                with open(self.log_path, "a") as output:
+                    output.write(line + "\n")
+            else:
+                print(line, file=sys.stdout, flush=True)
+
+    def _log_slow(self, store, handler, duration_ms, statement, plan_fn=None):
+        """plan_fn is a function returning the plan summary , called on the explain thread."""
+        if duration_ms < self.threshold_ms:
+            return
+        self.slow_queries += 1
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "type": "slow_query",
+            "store": store,
+            "handler": handler,
+            "duration_ms": round(duration_ms, 3),
+            "statement": statement,
+            "plan": None
+        }
+        if not plan_fn or not self.explain:
+            self.write(record)
+            return
+
+        cached = self._plans.get((store, statement))
+        if cached and time.monotonic() - cached[0] < self.plan_ttl:
+            record["plan"] = cached[1]
+            self.write(record)
+            return
+        self._start_explain_thread()
+        try:
+            self._explains.put_nowait((record, (store, statement), plan_fn))
+        except Full:
+            self.explains_skipped += 1
+            self.write(record)
+
+    def _start_explain_thread(self):
+        if self._explain_thread is None:
+            with self._lock:
+                if self._explain_thread is None:
+                    self._explain_thread = Thread(target=self._run_explains, name="query-explain", daemon=True)
+                    self._explain_thread.start()
+
+    def _run_explains(self):
+        while True:
+            record, key, plan_fn = self._explains.get()
+            record["plan"] = self._cached_plan(key, plan_fn)
+            self.write(record)
+
+    @property
+    def _tracing_disabled(self):
+        # set while the tracer runs its own explain queries
+        return getattr(self._local, "explaining", False)
+
+    def _cached_plan(self, key, compute):
+        cached = self._plans.get(key)
+        if cached and time.monotonic() - cached[0] < self.plan_ttl:
+            return cached[1]
+        self._local.explaining = True
+        try:
+            plan = compute()
+        except Exception as e:
+            plan = f"explain failed: {e}"
+        finally:
+            self._local.explaining = False
+        self._plans[key] = (time.monotonic(), plan)
+        return plan
+
+    @property
+    def stats(self):
+        return {
+            "slow_queries": self.slow_queries,
+            "repeated_queries": self.repeated_queries,
+            "pending_explains": self._explains.qsize(),
+            "explains_skipped": self.explains_skipped,
+            "threshold_ms": self.threshold_ms
+        }
+
+    # -- Mongo
+
+    def mongo_listener(self):
+        return MongoTraceListener(self)
+
+    def _mongo_plan(self, database, command):
+        explainable = {key: value for key, value in command.items() if key not in MONGO_DRIVER_KEYS}
+        result = self.get_db().client[database].command({"explain": explainable, "verbosity": "queryPlanner"})
+        return mongo_plan_summary(result.get("queryPlanner", {}).get("winningPlan"))
+
+    # -- SQLAlchemy
+
+    def install(self, engine_class):
+        """Hooks the cursor events of every SQLAlchemy engine."""
+        from sqlalchemy import event
+        event.listen(engine_class, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine_class, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine_class, "handle_error", self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        # the statement raised , after_cursor_execute won't run for it
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.get("query_started"):
+            return
+        started = conn.info["query_started"].pop()
+        if self._tracing_disabled:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        statement_text = " ".join(statement.split())
+        trace = self.get_trace()
+        if trace is not None:
+            trace.counts[("sql", statement_text)] += 1
+
+        engine = conn.engine
+        plan_fn = (lambda: self._sql_plan(engine, statement, parameters)) if not executemany and statement_text.upper().startswith("SELECT") else None
+        self._log_slow("sql", trace.handler if trace else None, duration_ms, statement_text, plan_fn)
+
+    def _sql_plan(self, engine, statement, parameters):
+        # a DBAPI connection of its own , so the explain doesn't go through these events again
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            try:
+                if engine.dialect.name == "postgresql":
+                    cursor.execute("EXPLAIN " + statement, parameters)
+                    return " | ".join(row[0].strip() for row in cursor.fetchall()[:5])
+                if engine.dialect.name == "sqlite":
+                    cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+                    return " | ".join(row[-1] for row in cursor.fetchall())
+                return None
+            finally:
+                cursor.close()
+        finally:
+            # back to the pool , which rolls the transaction back
+            connection.close()
+
+
+class MongoTraceListener(monitoring.CommandListener):
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def started(self, event):
+        if self.tracer._tracing_disabled:
+            return
+        trace = self.tracer.get_trace()
+        statement = json.dumps(query_shape(event.command), default=str)
+        command = event.command if event.command_name in MONGO_EXPLAINABLE else None
+        with self.tracer._lock:
+            self.tracer._pending[event.request_id] = (statement, event.database_name, command, trace.handler if trace else None)
+        if trace is not None:
+            trace.counts[("mongo", statement)] += 1
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self.tracer._lock:
+            pending = self.tracer._pending.pop(event.request_id, None)
+        if pending is None:
+            return
+        statement, database, command, handler = pending
+
+        plan_fn = (lambda: self.tracer._mongo_plan(database, command)) if command is not None and self.tracer.get_db else None
+        self.tracer._log_slow("mongo", handler, event.duration_micros / 1000, statement, plan_fn)
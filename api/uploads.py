@@ -0,0 +1,91 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkStore:
+    """Disk side of the chunked upload protocol.
+
+    Every upload gets a folder holding one file per chunk , so chunks can arrive in any order ,
+    be sent again after a disconnect , and never sit in memory. assemble() concatenates them in
+    order into the final file while hashing it.
+    """
+    def __init__(self, folder, chunk_size, buffer_size=64 * 1024):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+
+    def new_upload_id(self):
+        return uuid.uuid4().hex
+
+    def _upload_folder(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadError("Invalid upload id")
+        return os.path.join(self.folder, upload_id)
+
+    def _chunk_path(self, upload_id, index):
+        return os.path.join(self._upload_folder(upload_id), f"{index}.chunk")
+
+    def expected_length(self, size, index):
+        """Number of bytes chunk index must hold for a file of the given size."""
+        return min(self.chunk_size, size - index * self.chunk_size)
+
+    def total_chunks(self, size):
+        return max(1, -(-size // self.chunk_size))
+
+    def write_chunk(self, upload_id, index, stream, expected_length):
+        """Streams one chunk to disk , rejects it as soon as it holds more bytes than expected."""
+        folder = self._upload_folder(upload_id)
+        os.makedirs(folder, exist_ok=True)
+        path = self._chunk_path(upload_id, index)
+        partial_path = path + ".part"
+
+        written = 0
+        with open(partial_path, "wb") as destination:
+            for buffer in iter(lambda: stream.read(self.buffer_size), b""):
+                written += len(buffer)
+                if written > expected_length:
+                    break
+                destination.write(buffer)
+
+        if written != expected_length:
+            os.remove(partial_path)
+            raise UploadError(f"Chunk {index} must be {expected_length} bytes")
+
+        # the chunk only becomes visible once it is complete
+        os.replace(partial_path, path)
+        return written
+
+    def received(self, upload_id):
+        folder = self._upload_folder(upload_id)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(int(name.split(".")[0]) for name in os.listdir(folder) if name.endswith(".chunk"))
+
+    def assemble(self, upload_id, total_chunks):
+        """Concatenates the chunks into one file inside the upload folder.
+        Returns its path , size and sha256 hex digest.
+        """
+        missing = sorted(set(range(total_chunks)) - set(self.received(upload_id)))
+        if missing:
+            raise UploadError(f"Missing chunks: {missing}")
+
+        digest = hashlib.sha256()
+        size = 0
+        path = os.path.join(self._upload_folder(upload_id), "assembled")
+        with open(path, "wb") as destination:
+            for index in range(total_chunks):
+                with open(self._chunk_path(upload_id, index), "rb") as chunk:
+                    for buffer in iter(lambda: chunk.read(self.buffer_size), b""):
+                        digest.update(buffer)
+                        size += len(buffer)
+                        destination.write(buffer)
+        return path, size, digest.hexdigest()
+
+    def discard(self, upload_id):
+        shutil.rmtree(self._upload_folder(upload_id), ignore_errors=True)
@@ -0,0 +1,54 @@
+"""Starts several API workers ( serve.py , eventlet or gevent ) on consecutive ports.
+
+Every worker is a separate process , so they must share a Socket.IO message queue
+(SOCKETIO_MESSAGE_QUEUE) for room broadcasts and a presence store (PRESENCE_REDIS_URL) , which
+also carries the room cache invalidations ( ROOM_CACHE_REDIS_URL overrides it ).
+Socket.IO needs sticky sessions : the front proxy has to send every request of a client
+to the same worker , e.g. with nginx :
+
+    upstream insync {
+        ip_hash;
+        server 127.0.0.1:16000;
+        server 127.0.0.1:16001;
+    }
+
+usage : python workers.py [--workers N] [--host HOST] [--port FIRST_PORT]
+"""
+import argparse , os , subprocess , sys
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run N InSync API workers behind a sticky proxy")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default=os.getenv("INSYNC_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("INSYNC_PORT", 16000)))
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.workers > 1:
+        missing = [name for name in ("SOCKETIO_MESSAGE_QUEUE", "PRESENCE_REDIS_URL") if not os.getenv(name)]
+        if missing:
+            sys.exit(f"{', '.join(missing)} must be set to run more than one worker")
+
+    serve_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+    processes = []
+    for index in range(args.workers):
+        env = dict(os.environ, INSYNC_HOST=args.host, INSYNC_PORT=str(args.port + index))
+        processes.append(subprocess.Popen([sys.executable, serve_path], env=env))
+        print(f"worker {index} listening on {args.host}:{args.port + index}")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
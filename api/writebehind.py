@@ -0,0 +1,179 @@
+from queue import Queue , Empty , Full
+from threading import Thread , Lock
+import time
+
+import bson
+from pymongo.errors import BulkWriteError , ConnectionFailure , ExecutionTimeout , PyMongoError , WTimeoutError
+
+
+# worth retrying , the same write can succeed once Mongo is reachable again
+TRANSIENT_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+
+
+def is_transient(error):
+    return isinstance(error, TRANSIENT_ERRORS) or (isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError"))
+
+
+class WriteBehindWriter:
+    """Buffers documents in a bounded queue and writes them with insert_many from one background thread.
+
+    A batch is flushed when it reaches batch_size documents or when flush_interval seconds passed since
+    its first document. A single writer thread keeps the documents in submission order.
+    When Mongo lags and the buffer is full , submit() blocks up to put_timeout seconds and then
+    falls back to a synchronous insert , so the socket handlers slow down instead of losing messages.
+    Network and transient errors are retried , documents that can never be written ( not encodable ,
+    rejected by a validator ) are logged and counted as dead letters so they don't block the queue.
+    """
+    def __init__(self, get_collection, batch_size=500, flush_interval=0.05, max_pending=10000, put_timeout=1.0, retry_delay=0.5):
+        self.get_collection = get_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retry_delay = retry_delay
+        self._queue = Queue(maxsize=max_pending)
+        self._thread = None
+        self._closing = False
+        self._lock = Lock()
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.sync_writes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.dead_letters = 0
+        self.max_depth = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, document):
+        if self._closing:
+            self._insert_now(document)
+            return
+        try:
+            self._queue.put(document, timeout=self.put_timeout)
+        except Full:
+            # backpressure : the buffer is full because Mongo lags , write on the caller's thread
+            self._insert_now(document)
+            return
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def close(self, timeout=None):
+        """Stops accepting documents and flushes everything still buffered , in order."""
+        self._closing = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    @property
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "written": self.written,
+            "batches": self.batches,
+            "sync_writes": self.sync_writes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "dead_letters": self.dead_letters
+        }
+
+    def _insert_now(self, document):
+        self.get_collection().insert_one(document)
+        self.sync_writes += 1
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # the only writer thread must survive , everything queued behind the batch depends on it
+                    self.failures += 1
+                    self._dead_letter(batch, e)
+            elif self._closing:
+                return
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _dead_letter(self, documents, reason):
+        self.dead_letters += len(documents)
+        for document in documents:
+            print(f"write-behind: dead letter ( {reason} ): {str(document)[:500]}")
+
+    def _unencodable(self, batch):
+        bad = []
+        for document in batch:
+            try:
+                bson.encode(document)
+            except Exception:
+                bad.append(document)
+        return bad
+
+    def _write(self, batch):
+        attempts = 0
+        while batch:
+            try:
+                self.get_collection().insert_many(batch, ordered=True)
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except BulkWriteError as e:
+                # ordered insert : everything before the failing document is already stored
+                inserted = e.details.get("nInserted", 0)
+                self.written += inserted
+                batch = batch[inserted:]
+                self.failures += 1
+                errors = e.details.get("writeErrors")
+                print(f"write-behind: bulk write failed after {inserted} documents: {errors}")
+                if errors:
+                    if errors[0].get("code") != 11000:
+                        self._dead_letter(batch[:1], errors[0].get("errmsg"))
+                    # a duplicate key means the document was stored by an earlier attempt
+                    batch = batch[1:]
+                    continue
+            except PyMongoError as e:
+                self.failures += 1
+                print(f"write-behind: insert_many failed: {e}")
+                if not is_transient(e):
+                    self._dead_letter(batch, e)
+                    return
+            except Exception as e:
+                # raised while encoding , before anything was sent
+                self.failures += 1
+                bad = self._unencodable(batch) or batch
+                self._dead_letter(bad, e)
+                batch = [document for document in batch if not any(document is other for other in bad)]
+                continue
+
+            attempts += 1
+            if self._closing and attempts >= 3:
+                self.dropped += len(batch)
+                print(f"write-behind: dropping {len(batch)} documents on shutdown")
+                return
+            time.sleep(min(self.retry_delay * 2 ** (attempts - 1), 10))
@@ -266,10 +266,10 @@ export function Chats({ selectedChat, user, token, socket ,setchat }) {
                     src={
                         isGroupChat
                             ? selectedChat.room_picture
-                                ? `http://192.168.100.9:16000/rooms/${selectedChat.room_picture}`
+                                ? `http://192.168.100.9:16000/rooms/${selectedChat.room_picture}?size=64`
                                 : ""
                                 : selectedChat.users?.[0]?.profile_picture
-                            ? `http://192.168.100.9:16000/users/${selectedChat.users[0].profile_picture}`
+                            ? `http://192.168.100.9:16000/users/${selectedChat.users[0].profile_picture}?size=64`
                             : ""
                     }
                 >
@@ -373,7 +373,7 @@ export function Chats({ selectedChat, user, token, socket ,setchat }) {
                                 }}
                                 src={
                                     selectedChat?.users?.[0]?.profile_picture
-                                        ? `http://192.168.100.9:16000/users/${selectedChat.users[0].profile_picture}`
+                                        ? `http://192.168.100.9:16000/users/${selectedChat.users[0].profile_picture}?size=64`
                                         : ""
                                 }
                             />
@@ -564,7 +564,7 @@ export function Chats({ selectedChat, user, token, socket ,setchat }) {
                             }}
                             src={
                                 selectedChat.users[0].profile_picture
-                                    ? `http://192.168.100.9:16000/users/${selectedChat.users[0].profile_picture}`
+                                    ? `http://192.168.100.9:16000/users/${selectedChat.users[0].profile_picture}?size=64`
                                     : ""
                             }
                             alt={selectedChat.users[0].username}
@@ -75,7 +75,7 @@ function DM({ dm, onSelectChat }) {
     >
       <Avatar
         sx={{ width: 30, height: 30, backgroundColor: "#5E3F75" }}
-        src={profile_picture ? `http://192.168.100.9:16000/users/${profile_picture}` : ""}
+        src={profile_picture ? `http://192.168.100.9:16000/users/${profile_picture}?size=64` : ""}
       >
       </Avatar>
       <Box>
@@ -214,6 +214,10 @@ export function Dms({ user, token, onSelectChat, refetchUser , notifications ,se
       return acc;
   }, {});
 
+    // Notifications fetched from the API carry an unread_count , realtime ones count as one message
+    const countUnread = (notifs) => notifs.reduce((total, notif) => total + (notif.unread_count || 1), 0);
+    const unreadCount = countUnread(notifications);
+
 
   return (
     <Box
@@ -267,7 +271,7 @@ export function Dms({ user, token, onSelectChat, refetchUser , notifications ,se
                     color="inherit"
                     onClick={handleNotificationClick}
                 >
-                    <Badge badgeContent={notifications.length} color="error">
+                    <Badge badgeContent={unreadCount} color="error">
                         <NotificationsIcon />
                     </Badge>
                 </IconButton>
@@ -281,7 +285,7 @@ export function Dms({ user, token, onSelectChat, refetchUser , notifications ,se
                     ) : (
                       Object.keys(groupedNotifications).map((room_id) => (
                         <MenuItem key={room_id}>
-                            You got {groupedNotifications[room_id].length} messages from {groupedNotifications[room_id][0].room_name}
+                            You got {countUnread(groupedNotifications[room_id])} messages from {groupedNotifications[room_id][0].room_name}
                         </MenuItem>
                     ))
                     )}
@@ -367,7 +371,7 @@ export function Dms({ user, token, onSelectChat, refetchUser , notifications ,se
             height: 40,
             marginRight: 2,
           }}
-          src={user?.profile_picture ? `http://192.168.100.9:16000/users/${user.profile_picture}` : ""}
+          src={user?.profile_picture ? `http://192.168.100.9:16000/users/${user.profile_picture}?size=64` : ""}
         >
         </Avatar>
         <Typography variant="body1" color="white">{user?.username}</Typography>
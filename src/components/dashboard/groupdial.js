@@ -108,7 +108,7 @@ export function GroupInfoDialog({ open, onClose, group, users , onLeaveGroup })
             <ListItem key={user.username} >
               <ListItemAvatar>
                 <Avatar
-                  src={`http://192.168.100.9:16000/users/${user.profile_picture}`}
+                  src={`http://192.168.100.9:16000/users/${user.profile_picture}?size=64`}
                   alt={user.username}
                 >
                   {!user.profile_picture && user.username[0].toUpperCase()}
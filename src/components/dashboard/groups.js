@@ -207,7 +207,7 @@ export function Groups({ token, onSelectChat }) {
                             bgcolor: "#5E3F75",
                         },
                     }}
-                    src={group.room_picture ? `http://192.168.100.9:16000/rooms/${group.room_picture}` : ""}
+                    src={group.room_picture ? `http://192.168.100.9:16000/rooms/${group.room_picture}?size=64` : ""}
 
                 >
                 </Avatar>
@@ -129,7 +129,7 @@ export function UserProfileDialog({ openProfile, handleCloseProfile, user, token
                 height: 80,
                 marginBottom: 2,
               }}
-              src={preview || (user?.profile_picture ? `http://192.168.100.9:16000/users/${user.profile_picture}` : "")}
+              src={preview || (user?.profile_picture ? `http://192.168.100.9:16000/users/${user.profile_picture}?size=256` : "")}
               alt={`${user.first_name} ${user.last_name}`}
             />
             <IconButton
@@ -44,7 +44,7 @@ export function ViewUserDialog({ open, onClose, user, onSendMessage }) {
               height: 80,
               marginBottom: 2,
             }}
-            src={user.profile_picture ? `http://192.168.100.9:16000/users/${user.profile_picture}` : ""}
+            src={user.profile_picture ? `http://192.168.100.9:16000/users/${user.profile_picture}?size=64` : ""}
             alt={user.username}
           />
           <Typography variant="h6" sx={{ color: "#E5E7EB" }}>
@@ -80,8 +80,11 @@ export function ViewUserDialog({ open, onClose, user, onSendMessage }) {
   );
 }
 
-const fetchUsers = async (token) => {
-  const response = await fetch("/user/users", {
+const fetchUsers = async (token, query) => {
+  // The API matches the start of the username or names , the remaining words are filtered below
+  const firstWord = query.trim().split(/\s+/)[0];
+  const url = firstWord ? `/user/users?q=${encodeURIComponent(firstWord)}` : "/user/users";
+  const response = await fetch(url, {
     method: "GET",
     headers: {
       "Content-Type": "application/json",
@@ -103,8 +106,8 @@ export function UserListDialog({ open, onClose, token, onSendMessage, currentUse
   const [searchQuery, setSearchQuery] = useState("");
 
   const { data: users, isLoading, isError, error } = useQuery({
-    queryKey: ["users", token],
-    queryFn: () => fetchUsers(token),
+    queryKey: ["users", token, searchQuery.trim().split(/\s+/)[0]],
+    queryFn: () => fetchUsers(token, searchQuery),
     enabled: open,
   });
 
@@ -197,7 +200,7 @@ export function UserListDialog({ open, onClose, token, onSendMessage, currentUse
                   <ListItem key={user.username} button onClick={() => handleUserClick(user)}>
                     <ListItemAvatar>
                       <Avatar
-                        src={`http://192.168.100.9:16000/users/${user.profile_picture}`}
+                        src={`http://192.168.100.9:16000/users/${user.profile_picture}?size=64`}
                         alt={user.username}
                       >
                         {!user.profile_picture && user.username[0].toUpperCase()}